@@ -12,7 +12,7 @@ sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), ".."
 load_dotenv()
 
 # import my models
-from database import Base
+from database import Base, SEARCH_SCHEMA_NAMES
 from database import User, JobApplication
 
 # this is the Alembic Config object, which provides
@@ -32,6 +32,13 @@ if config.config_file_name is not None:
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+
+# the full text search objects are created by hand in their migration, don't let autogenerate drop them
+def include_object(object, name, type_, reflected, compare_to):
+    if name is None:
+        return True
+    return name not in SEARCH_SCHEMA_NAMES and not name.startswith("scraped_jobs_fts_")
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -56,6 +63,7 @@ def run_migrations_offline() -> None:
         target_metadata=target_metadata,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
+        include_object=include_object,
     )
 
     with context.begin_transaction():
@@ -77,7 +85,8 @@ def run_migrations_online() -> None:
 
     with connectable.connect() as connection:
         context.configure(
-            connection=connection, target_metadata=target_metadata
+            connection=connection, target_metadata=target_metadata,
+            include_object=include_object
         )
 
         with context.begin_transaction():
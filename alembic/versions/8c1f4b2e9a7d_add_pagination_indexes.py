@@ -0,0 +1,32 @@
+"""Add composite indexes for keyset pagination
+
+Revision ID: 8c1f4b2e9a7d
+Revises: 6eaa3ca95b6c
+Create Date: 2026-10-17 09:12:31.418220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8c1f4b2e9a7d'
+down_revision: Union[str, Sequence[str], None] = '6eaa3ca95b6c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_applications_user_id_updated_at_id', 'applications', ['user_id', 'updated_at', 'id'], unique=False)
+    op.create_index('ix_scraped_jobs_scraped_at_id', 'scraped_jobs', ['scraped_at', 'id'], unique=False)
+    op.create_index('ix_scraped_jobs_source_scraped_at_id', 'scraped_jobs', ['source', 'scraped_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_scraped_jobs_source_scraped_at_id', table_name='scraped_jobs')
+    op.drop_index('ix_scraped_jobs_scraped_at_id', table_name='scraped_jobs')
+    op.drop_index('ix_applications_user_id_updated_at_id', table_name='applications')
@@ -0,0 +1,67 @@
+"""Add application stats tables
+
+Revision ID: a7c2e5f90d14
+Revises: f3a8c6d1e2b9
+Create Date: 2026-10-17 16:40:12.553081
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c2e5f90d14'
+down_revision: Union[str, Sequence[str], None] = 'f3a8c6d1e2b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the type already exists, it was created with the applications table
+application_status = postgresql.ENUM(
+    'WISHLIST', 'APPLIED', 'PHONE_SCREEN', 'INTERVIEW', 'OFFER', 'REJECTED', 'ACCEPTED',
+    name='applicationstatus', create_type=False
+)
+
+# the monday of the week an application was created, same as stats.week_start_column
+WEEK_START = {
+    'postgresql': "CAST(date_trunc('week', created_at) AS DATE)",
+    'sqlite': "date(created_at, 'weekday 0', '-6 days')",
+}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('application_status_counts',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('status', application_status, nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'status')
+    )
+    op.create_table('application_weekly_counts',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('week_start', sa.Date(), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('user_id', 'week_start')
+    )
+
+    # backfill the counters from the applications already stored
+    op.execute(
+        "INSERT INTO application_status_counts (user_id, status, count) "
+        "SELECT user_id, status, COUNT(*) FROM applications WHERE status IS NOT NULL GROUP BY user_id, status"
+    )
+    week_start = WEEK_START.get(op.get_bind().dialect.name)
+    if week_start is not None:
+        op.execute(
+            f"INSERT INTO application_weekly_counts (user_id, week_start, count) "
+            f"SELECT user_id, {week_start}, COUNT(*) FROM applications WHERE created_at IS NOT NULL GROUP BY user_id, {week_start}"
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('application_weekly_counts')
+    op.drop_table('application_status_counts')
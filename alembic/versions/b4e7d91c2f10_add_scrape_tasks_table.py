@@ -0,0 +1,61 @@
+"""Add scrape_tasks table
+
+Revision ID: b4e7d91c2f10
+Revises: 8c1f4b2e9a7d
+Create Date: 2026-10-17 11:02:45.903112
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4e7d91c2f10'
+down_revision: Union[str, Sequence[str], None] = '8c1f4b2e9a7d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+scrape_task_status = sa.Enum('PENDING', 'RUNNING', 'SUCCEEDED', 'FAILED', name='scrapetaskstatus')
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('scrape_tasks',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('query', sa.String(), nullable=False),
+    sa.Column('location', sa.String(), nullable=False),
+    sa.Column('max_results', sa.Integer(), nullable=False),
+    sa.Column('sources', sa.JSON(), nullable=False),
+    sa.Column('dedupe_key', sa.String(), nullable=False),
+    sa.Column('status', scrape_task_status, nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('scraped', sa.Integer(), nullable=False),
+    sa.Column('inserted', sa.Integer(), nullable=False),
+    sa.Column('duplicates', sa.Integer(), nullable=False),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_scrape_tasks_id'), 'scrape_tasks', ['id'], unique=False)
+    op.create_index('ix_scrape_tasks_status_next_attempt_at', 'scrape_tasks', ['status', 'next_attempt_at'], unique=False)
+    op.create_index(
+        'uq_scrape_tasks_active_dedupe_key', 'scrape_tasks', ['dedupe_key'], unique=True,
+        postgresql_where=sa.text("status IN ('PENDING', 'RUNNING')"),
+        sqlite_where=sa.text("status IN ('PENDING', 'RUNNING')")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_scrape_tasks_active_dedupe_key', table_name='scrape_tasks')
+    op.drop_index('ix_scrape_tasks_status_next_attempt_at', table_name='scrape_tasks')
+    op.drop_index(op.f('ix_scrape_tasks_id'), table_name='scrape_tasks')
+    op.drop_table('scrape_tasks')
+    scrape_task_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,28 @@
+"""Add index on refresh_tokens expires_at
+
+Revision ID: b8d3f6a2c915
+Revises: e9b4a2c7d185
+Create Date: 2026-10-17 23:41:19.337052
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d3f6a2c915'
+down_revision: Union[str, Sequence[str], None] = 'e9b4a2c7d185'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_refresh_tokens_expires_at'), 'refresh_tokens', ['expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_refresh_tokens_expires_at'), table_name='refresh_tokens')
@@ -0,0 +1,43 @@
+"""Add unique index on applications user_id and job_url
+
+Revision ID: c5d8e3f17a62
+Revises: a7c2e5f90d14
+Create Date: 2026-10-17 19:05:47.209316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d8e3f17a62'
+down_revision: Union[str, Sequence[str], None] = 'a7c2e5f90d14'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # the oldest application of each user and job_url keeps the url, later duplicates keep it in their notes
+    # nothing is deleted so the stats counters stay right
+    op.execute(
+        """
+        UPDATE applications
+        SET notes = COALESCE(notes || ' ', '') || '(Duplicate of an earlier application for ' || job_url || ')',
+            job_url = NULL
+        WHERE job_url IS NOT NULL AND EXISTS (
+            SELECT 1 FROM applications AS earlier
+            WHERE earlier.user_id = applications.user_id
+              AND earlier.job_url = applications.job_url
+              AND earlier.id < applications.id
+        )
+        """
+    )
+    op.create_index('uq_applications_user_id_job_url', 'applications', ['user_id', 'job_url'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_applications_user_id_job_url', table_name='applications')
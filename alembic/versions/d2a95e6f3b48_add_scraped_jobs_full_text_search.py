@@ -0,0 +1,70 @@
+"""Add full text search index over scraped_jobs
+
+Revision ID: d2a95e6f3b48
+Revises: b4e7d91c2f10
+Create Date: 2026-10-17 13:37:20.118406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a95e6f3b48'
+down_revision: Union[str, Sequence[str], None] = 'b4e7d91c2f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# weighted tsvector kept current by postgres as a generated column
+POSTGRES_DDL = [
+    '''ALTER TABLE scraped_jobs ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(company, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED''',
+    "CREATE INDEX ix_scraped_jobs_search_vector ON scraped_jobs USING GIN (search_vector)",
+]
+
+# external content FTS5 table kept in sync by triggers
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE scraped_jobs_fts USING fts5(title, company, description, content='scraped_jobs', content_rowid='id')",
+    '''CREATE TRIGGER scraped_jobs_fts_insert AFTER INSERT ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(rowid, title, company, description) VALUES (new.id, new.title, new.company, new.description);
+    END''',
+    '''CREATE TRIGGER scraped_jobs_fts_delete AFTER DELETE ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(scraped_jobs_fts, rowid, title, company, description) VALUES ('delete', old.id, old.title, old.company, old.description);
+    END''',
+    '''CREATE TRIGGER scraped_jobs_fts_update AFTER UPDATE OF title, company, description ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(scraped_jobs_fts, rowid, title, company, description) VALUES ('delete', old.id, old.title, old.company, old.description);
+        INSERT INTO scraped_jobs_fts(rowid, title, company, description) VALUES (new.id, new.title, new.company, new.description);
+    END''',
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # the generated column is computed for existing rows as it is added
+        for statement in POSTGRES_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            op.execute(statement)
+        # index the rows that are already there
+        op.execute("INSERT INTO scraped_jobs_fts(scraped_jobs_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_scraped_jobs_search_vector")
+        op.execute("ALTER TABLE scraped_jobs DROP COLUMN IF EXISTS search_vector")
+    elif dialect == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS scraped_jobs_fts_update")
+        op.execute("DROP TRIGGER IF EXISTS scraped_jobs_fts_delete")
+        op.execute("DROP TRIGGER IF EXISTS scraped_jobs_fts_insert")
+        op.execute("DROP TABLE IF EXISTS scraped_jobs_fts")
@@ -0,0 +1,42 @@
+"""Add near duplicate signatures and LSH buckets for scraped jobs
+
+Revision ID: e61c0a8d7b23
+Revises: d2a95e6f3b48
+Create Date: 2026-10-17 15:21:04.660187
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e61c0a8d7b23'
+down_revision: Union[str, Sequence[str], None] = 'd2a95e6f3b48'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('scraped_jobs', sa.Column('minhash', sa.LargeBinary(), nullable=True))
+    op.add_column('scraped_jobs', sa.Column('cluster_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_scraped_jobs_cluster_id'), 'scraped_jobs', ['cluster_id'], unique=False)
+    op.create_table('scraped_job_buckets',
+    sa.Column('bucket', sa.BigInteger(), nullable=False),
+    sa.Column('job_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['job_id'], ['scraped_jobs.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('bucket', 'job_id')
+    )
+    op.create_index(op.f('ix_scraped_job_buckets_job_id'), 'scraped_job_buckets', ['job_id'], unique=False)
+    # existing jobs are signed and clustered afterwards with `python dedup.py`
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scraped_job_buckets_job_id'), table_name='scraped_job_buckets')
+    op.drop_table('scraped_job_buckets')
+    op.drop_index(op.f('ix_scraped_jobs_cluster_id'), table_name='scraped_jobs')
+    op.drop_column('scraped_jobs', 'cluster_id')
+    op.drop_column('scraped_jobs', 'minhash')
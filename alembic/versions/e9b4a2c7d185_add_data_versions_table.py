@@ -0,0 +1,34 @@
+"""Add data_versions table
+
+Revision ID: e9b4a2c7d185
+Revises: c5d8e3f17a62
+Create Date: 2026-10-17 21:14:06.581930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9b4a2c7d185'
+down_revision: Union[str, Sequence[str], None] = 'c5d8e3f17a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    data_versions = op.create_table('data_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    # bump_data_version only updates, the counter row has to exist
+    op.bulk_insert(data_versions, [{'name': 'scraped_jobs', 'version': 0}])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('data_versions')
@@ -1,12 +1,23 @@
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from database import get_db, User
+from sqlalchemy import event, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from metrics import registry, CallbackMetric
+from database import get_replica_db, AsyncSessionLocal, DATABASE_READ_URL, User, RefreshToken
+from passwords import (
+    verify_password, verify_and_update_password, get_password_hash,
+    verify_and_update_password_async, get_password_hash_async
+)
+import hashlib
 import os
+import secrets
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -15,19 +26,15 @@ load_dotenv()
 SECRET_KEY = os.getenv("SECRET_KEY", "fallback-key-for-development")
 ALGROITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
 
-# password hashing
-pwd_content = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# authenticated users are cached per token so protected requests skip the users table
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
 
 # check for what token in requests
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_content.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    return pwd_content.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     # create a jwt token
     to_encode = data.copy()
@@ -39,8 +46,164 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGROITHM)
     return encoded_jwt
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# refresh tokens are random so a fast digest is enough to store them, no need for bcrypt
+def _refresh_token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _invalid_refresh_token():
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+# stores a new refresh token for the user, a new family starts at every login
+# the caller commits
+def create_refresh_token(db: AsyncSession, user_id: int, family_id: Optional[str] = None) -> str:
+    token = secrets.token_urlsafe(32)
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=_refresh_token_digest(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=datetime.now() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    ))
+    return token
+
+
+async def revoke_refresh_family(db: AsyncSession, family_id: str):
+    await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family_id == family_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.now())
+    )
+
+
+# trades a refresh token for the next one in its family, returns the user's email and the new token
+# a token that was already used means a copy leaked, so the whole family is revoked
+async def rotate_refresh_token(db: AsyncSession, token: str) -> Tuple[str, str]:
+    now = datetime.now()
+    stored = (await db.execute(
+        select(RefreshToken.id, RefreshToken.family_id, RefreshToken.expires_at, User.id.label("user_id"), User.email)
+        .join(User, User.id == RefreshToken.user_id)
+        .where(RefreshToken.token_hash == _refresh_token_digest(token))
+    )).first()
+    if stored is None or stored.expires_at <= now:
+        raise _invalid_refresh_token()
+
+    # only the request that flips revoked_at gets to rotate, a concurrent reuse matches no row
+    used = (await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == stored.id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )).rowcount
+    if not used:
+        await revoke_refresh_family(db, stored.family_id)
+        await db.commit()
+        raise _invalid_refresh_token()
+
+    new_token = create_refresh_token(db, stored.user_id, stored.family_id)
+    await db.commit()
+    return stored.email, new_token
+
+
+# logs a session out, unknown or already revoked tokens are ignored
+async def revoke_refresh_token(db: AsyncSession, token: str):
+    family_id = await db.scalar(select(RefreshToken.family_id).where(RefreshToken.token_hash == _refresh_token_digest(token)))
+    if family_id is not None:
+        await revoke_refresh_family(db, family_id)
+        await db.commit()
+
+# the logged in user as seen by protected endpoints
+# a plain immutable value, so it is safe to share between requests and never touches a db session
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+
+
+# bounded LRU of token -> principal, entries expire after the ttl or when the token does, whichever is first
+class PrincipalCache:
+    def __init__(self, maxsize: int = PRINCIPAL_CACHE_SIZE, ttl: float = PRINCIPAL_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple[float, Principal]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[token]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, token: str, principal: Principal, token_expires_at: float):
+        ttl = min(self.ttl, token_expires_at - time.time())
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[token] = (time.monotonic() + ttl, principal)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # drops every cached token of a user, call after changing or deleting a user outside the ORM
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in [token for token, (_, principal) in self._entries.items() if principal.id == user_id]:
+                del self._entries[token]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+principal_cache = PrincipalCache()
+
+registry.register(CallbackMetric(
+    "principal_cache_lookups_total", "Token lookups in the principal cache, by result.", ("result",),
+    lambda: {("hit",): principal_cache.hits, ("miss",): principal_cache.misses}, kind="counter"))
+registry.register(CallbackMetric(
+    "principal_cache_hit_ratio", "Share of token lookups answered by the principal cache.", (),
+    lambda: {(): principal_cache.stats()["hit_ratio"]}))
+registry.register(CallbackMetric(
+    "principal_cache_entries", "Tokens held in the principal cache.", (),
+    lambda: {(): principal_cache.stats()["size"]}))
+
+
+# changes to a user through the ORM invalidate their cached tokens
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_cached_user(mapper, connection, target):
+    principal_cache.invalidate_user(target.id)
+
+
+# the user lookup is a read, so it goes to the replica when there is one
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_replica_db)) -> Principal:
     # get the current auth user from the token
+    principal = principal_cache.get(token)
+    if principal is not None:
+        request.state.principal = principal
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -54,7 +217,17 @@ def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(
     except JWTError:
         raise credentials_exception
     
-    user = db.query(User).filter(User.email == email).first()
+    lookup = select(User.id, User.email).where(User.email == email)
+    user = (await db.execute(lookup)).first()
+    if user is None and DATABASE_READ_URL:
+        # a user who just registered may not have reached the replica yet
+        async with AsyncSessionLocal() as primary:
+            user = (await primary.execute(lookup)).first()
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+
+    principal = Principal(id=user.id, email=user.email)
+    principal_cache.put(token, principal, payload.get("exp", 0))
+    # lets the middleware see who made the request
+    request.state.principal = principal
+    return principal
\ No newline at end of file
@@ -0,0 +1,137 @@
+import argparse
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+# seeded synthetic data for benchmarks, the same seed and scale always produce the same rows
+# python benchmarks/datagen.py 100k --seed 7
+# writes to DATABASE_URL, local sqlite or postgres
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import insert, select
+from database import Base, SessionLocal, get_engine, JobApplication, ScrapedJob, User
+from passwords import pwd_context
+from schemas import ApplicationStatus
+import stats
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+# applications per generated user
+APPLICATIONS_PER_USER = 1000
+BENCHMARK_EMAIL = "user{}@bench.example.com"
+BENCHMARK_PASSWORD = "benchmark-password"
+INSERT_BATCH = 10_000
+
+# rough shape of a real pipeline, most applications never get past applied
+STATUS_WEIGHTS = {
+    ApplicationStatus.WISHLIST: 25,
+    ApplicationStatus.APPLIED: 40,
+    ApplicationStatus.PHONE_SCREEN: 10,
+    ApplicationStatus.INTERVIEW: 8,
+    ApplicationStatus.OFFER: 2,
+    ApplicationStatus.REJECTED: 14,
+    ApplicationStatus.ACCEPTED: 1,
+}
+TITLES = ["Software Engineer", "Backend Developer", "Data Engineer", "Frontend Developer", "DevOps Engineer",
+          "Machine Learning Engineer", "Site Reliability Engineer", "Full Stack Developer", "Platform Engineer"]
+LEVELS = ["Intern", "Junior", "", "Senior", "Staff", "Principal"]
+COMPANY_WORDS = ["Acme", "Globex", "Initech", "Umbrella", "Hooli", "Stark", "Wayne", "Wonka", "Cyberdyne", "Tyrell"]
+LOCATIONS = ["Remote", "New York, NY", "San Francisco, CA", "Austin, TX", "Seattle, WA", "Chicago, IL", "Boston, MA"]
+SOURCES = ["indeed", "mock"]
+WORDS = ("python django fastapi postgres kubernetes docker aws terraform react typescript team product customers "
+         "scale reliability ownership mentor design review testing deploy pipeline data latency services api "
+         "cloud growth remote hybrid benefits equity salary collaborate build ship improve").split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _title(rng: random.Random) -> str:
+    return f"{rng.choice(LEVELS)} {rng.choice(TITLES)}".strip()
+
+
+def _company(rng: random.Random) -> str:
+    return f"{rng.choice(COMPANY_WORDS)} {rng.choice(['Labs', 'Inc', 'Corp', 'Systems', 'Group'])} {rng.randrange(500)}"
+
+
+def _insert_batches(db, model, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH:
+            db.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.execute(insert(model), batch)
+
+
+def generate(db, rows: int, seed: int = 1) -> dict:
+    if db.scalar(select(User.id).where(User.email == BENCHMARK_EMAIL.format(0))) is not None:
+        raise SystemExit("Benchmark data is already loaded in this database")
+
+    rng = random.Random(seed)
+    now = datetime(2026, 1, 1)
+    users = max(1, rows // APPLICATIONS_PER_USER)
+    # one bcrypt hash shared by every user, hashing a million passwords would take hours
+    hashed_password = pwd_context.hash(BENCHMARK_PASSWORD)
+    db.execute(insert(User), [{"email": BENCHMARK_EMAIL.format(n), "hashed_password": hashed_password} for n in range(users)])
+    user_ids = list(db.scalars(select(User.id).where(User.email.like(BENCHMARK_EMAIL.format("%"))).order_by(User.id)))
+
+    statuses = list(STATUS_WEIGHTS)
+    weights = list(STATUS_WEIGHTS.values())
+
+    def applications():
+        for n in range(rows):
+            created_at = now - timedelta(minutes=rng.randrange(365 * 24 * 60))
+            status = rng.choices(statuses, weights)[0]
+            yield {
+                "user_id": user_ids[n % users],
+                "company": _company(rng),
+                "position": _title(rng),
+                "status": status,
+                "job_url": f"https://jobs.example.com/{seed}/{n}",
+                "notes": _text(rng, rng.randrange(0, 60)) if rng.random() < 0.6 else None,
+                "applied_date": created_at + timedelta(days=rng.randrange(7)) if status != ApplicationStatus.WISHLIST else None,
+                "salary_range": f"${rng.randrange(60, 200, 10)}k-${rng.randrange(200, 300, 10)}k" if rng.random() < 0.3 else None,
+                "created_at": created_at,
+                "updated_at": created_at + timedelta(days=rng.randrange(30)),
+            }
+
+    def scraped_jobs():
+        for n in range(rows):
+            scraped_at = now - timedelta(minutes=rng.randrange(90 * 24 * 60))
+            yield {
+                "title": _title(rng),
+                "company": _company(rng),
+                "location": rng.choice(LOCATIONS),
+                "url": f"https://www.indeed.com/viewjob?jk={seed}x{n}",
+                "description": _text(rng, rng.randrange(20, 120)),
+                "posted_date": scraped_at - timedelta(days=rng.randrange(14)),
+                "source": rng.choice(SOURCES),
+                "scraped_at": scraped_at,
+            }
+
+    _insert_batches(db, JobApplication, applications())
+    _insert_batches(db, ScrapedJob, scraped_jobs())
+    db.commit()
+    # the stats counters are normally kept by the api, fill them for the rows inserted behind its back
+    stats.rebuild(db)
+    return {"users": users, "applications": rows, "scraped_jobs": rows}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load synthetic users, applications and scraped jobs")
+    parser.add_argument("scale", choices=SCALES, help="applications and scraped jobs to create")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=get_engine())
+    session = SessionLocal()
+    try:
+        created = generate(session, SCALES[args.scale], args.seed)
+        print(f"Created {created['users']} users, {created['applications']} applications and {created['scraped_jobs']} scraped jobs")
+        print(f"Log in as {BENCHMARK_EMAIL.format(0)} / {BENCHMARK_PASSWORD}")
+    finally:
+        session.close()
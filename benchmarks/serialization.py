@@ -0,0 +1,90 @@
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# compares the per row cost of GET /applications before and after the orjson fast path
+# python benchmarks/serialization.py [rows]
+# runs against a throwaway sqlite database unless DATABASE_URL is set
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/benchmark.db")
+
+import orjson
+from sqlalchemy import delete, insert, select
+from database import Base, SessionLocal, get_engine, JobApplication, User
+from schemas import ApplicationResponse, ApplicationStatus
+from serialization import response_columns, rows_to_dicts
+
+ROUNDS = 5
+
+
+def seed(db, rows: int) -> int:
+    user = User(email="benchmark@example.com", hashed_password="x")
+    db.add(user)
+    db.flush()
+    statuses = list(ApplicationStatus)
+    now = datetime.now()
+    db.execute(insert(JobApplication), [
+        {
+            "user_id": user.id,
+            "company": f"Company {i}",
+            "position": "Software Engineer",
+            "status": statuses[i % len(statuses)],
+            "job_url": f"https://example.com/jobs/{i}",
+            "notes": "Referred by a friend, follow up next week",
+            "applied_date": now - timedelta(days=i % 90),
+            "salary_range": "$80k-$100k",
+            "created_at": now,
+            "updated_at": now - timedelta(seconds=i),
+        }
+        for i in range(rows)
+    ])
+    db.commit()
+    return user.id
+
+
+# ORM objects validated one by one into the response model, then stdlib json
+def before(db, user_id: int) -> bytes:
+    applications = db.scalars(select(JobApplication).where(JobApplication.user_id == user_id)).all()
+    items = [ApplicationResponse.model_validate(application).model_dump(mode="json") for application in applications]
+    return json.dumps({"count": len(items), "applications": items, "next_cursor": None}).encode()
+
+
+# plain column tuples straight into orjson
+def after(db, user_id: int) -> bytes:
+    rows = db.execute(select(*response_columns(ApplicationResponse, JobApplication)).where(JobApplication.user_id == user_id)).all()
+    return orjson.dumps({"count": len(rows), "applications": rows_to_dicts(rows), "next_cursor": None})
+
+
+def best_of(fn, db, user_id: int) -> float:
+    timings = []
+    for _ in range(ROUNDS):
+        db.expunge_all()
+        start = time.perf_counter()
+        fn(db, user_id)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    Base.metadata.create_all(bind=get_engine())
+    db = SessionLocal()
+    user_id = seed(db, rows)
+    try:
+        assert json.loads(before(db, user_id)) == orjson.loads(after(db, user_id))
+
+        print(f"{rows} applications, best of {ROUNDS} runs")
+        slow = best_of(before, db, user_id)
+        fast = best_of(after, db, user_id)
+        for name, seconds in (("orm + pydantic + json", slow), ("columns + orjson", fast)):
+            print(f"  {name:<24}{seconds * 1000:8.1f} ms {seconds / rows * 1e6:8.2f} us/row")
+        print(f"  speedup {slow / fast:.1f}x")
+    finally:
+        db.execute(delete(JobApplication).where(JobApplication.user_id == user_id))
+        db.execute(delete(User).where(User.id == user_id))
+        db.commit()
+        db.close()
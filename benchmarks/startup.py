@@ -0,0 +1,79 @@
+import argparse
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+# import time of the api and the scrape worker, each measured in fresh interpreters
+# python benchmarks/startup.py [--runs 7] [--ref HEAD~5]
+# --ref measures an older commit the same way for comparison, older trees need a database so they get a throwaway sqlite file
+# fails when importing connects to the database or loads the scraping stack or a database driver
+
+REPO = os.path.realpath(os.path.join(os.path.dirname(__file__), ".."))
+MODULES = ["main", "worker"]
+# must not be loaded just by importing the api or the worker
+DEFERRED = ["bs4", "lxml", "scraper", "aiosqlite", "asyncpg", "psycopg2", "alembic"]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": sorted(name for name in {deferred!r} if name in sys.modules)}}))
+"""
+
+
+def measure(tree: str, module: str, runs: int, env: dict) -> dict:
+    timings = []
+    loaded = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE.format(module=module, deferred=DEFERRED)],
+            cwd=tree, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        timings.append(probe["seconds"])
+        loaded = probe["loaded"]
+    return {"median_ms": statistics.median(timings) * 1000, "loaded": loaded}
+
+
+def export_ref(ref: str, directory: str):
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO, capture_output=True, check=True).stdout
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        tar.extractall(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long importing the api and the worker takes")
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--ref", help="also measure this git revision")
+    args = parser.parse_args()
+
+    # no DATABASE_URL at all, importing must not need one
+    env = {key: value for key, value in os.environ.items() if key not in ("DATABASE_URL", "DATABASE_READ_URL")}
+    ok = True
+    results = {"working tree": {module: measure(REPO, module, args.runs, env) for module in MODULES}}
+
+    if args.ref:
+        with tempfile.TemporaryDirectory() as directory:
+            export_ref(args.ref, directory)
+            ref_env = dict(env, DATABASE_URL=f"sqlite:///{directory}/startup.db")
+            results[args.ref] = {module: measure(directory, module, args.runs, ref_env) for module in MODULES}
+
+    for tree, modules in results.items():
+        print(tree)
+        for module, result in modules.items():
+            if "error" in result:
+                print(f"  import {module:<8} FAILED: {result['error']}")
+                ok = ok and tree != "working tree"
+                continue
+            print(f"  import {module:<8} {result['median_ms']:8.1f} ms   loaded: {', '.join(result['loaded']) or 'nothing deferred'}")
+            if tree == "working tree" and result["loaded"]:
+                ok = False
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Optional
+
+# benchmark and query count regression suite
+# times every route of main.py through an in-process ASGI client, the worker's scrape ingest, the indeed parser and the auth helpers,
+# and fails when a route or the ingest runs more SQL statements than its budget, or a route has no benchmark at all
+# python benchmarks/suite.py [--scale 1k] [--iterations 20] [--json results.json]
+# runs against a throwaway sqlite database unless DATABASE_URL is set, seeding it with datagen.py when needed
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), "..")))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/suite.db")
+# the queue must stay untouched while routes are timed, and hashing inline keeps the timings in one process
+os.environ.setdefault("SCRAPE_WORKERS", "0")
+os.environ.setdefault("HASH_POOL_SIZE", "0")
+
+import httpx
+from fastapi.routing import APIRoute
+from jose import jwt
+from sqlalchemy import event, select
+import auth
+import main
+from database import Base, SessionLocal, User, JobApplication, ScrapedJob, dispose_engines, get_engine, get_async_engine, get_async_read_engine
+from datagen import SCALES, BENCHMARK_EMAIL, BENCHMARK_PASSWORD, generate
+from scraper import IndeedScraper
+from ingest import ingest_scraped_jobs
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+WARMUP = 2
+
+
+# counts the SQL statements sent by the given engines, async ones are counted through their sync engine
+class QueryCounter:
+    def __init__(self, *engines):
+        self.count = 0
+        for engine in {getattr(engine, "sync_engine", engine) for engine in engines}:
+            event.listen(engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+@dataclass
+class RouteCase:
+    method: str
+    route: str # the path as declared in main.py
+    budget: int # most SQL statements one warm request may run
+    build: Callable[[dict], Awaitable[dict]] # returns the httpx request arguments, setup done here isn't counted
+    expect: int = 200
+    after: Optional[Callable[[dict, httpx.Response], None]] = None
+
+
+def _get(url: str):
+    async def build(ctx):
+        return {"url": url.format(**ctx), "headers": ctx["headers"]}
+    return build
+
+
+async def _new_application(ctx) -> int:
+    response = await ctx["client"].post("/applications", json={"company": "Setup", "position": "Setup"}, headers=ctx["headers"])
+    return response.json()["id"]
+
+
+def _new_refresh_token(ctx) -> str:
+    # straight into the database, logging in for every iteration would mostly time bcrypt
+    db = SessionLocal()
+    try:
+        token = auth.create_refresh_token(db, ctx["user_id"])
+        db.commit()
+        return token
+    finally:
+        db.close()
+
+
+def route_cases() -> list:
+    async def register(ctx):
+        ctx["registered"] += 1
+        return {"url": "/register", "json": {"email": f"new{ctx['registered']}-{os.getpid()}@bench.example.com", "password": BENCHMARK_PASSWORD}}
+
+    async def login(ctx):
+        return {"url": "/token", "data": {"username": BENCHMARK_EMAIL.format(0), "password": BENCHMARK_PASSWORD}}
+
+    async def refresh(ctx):
+        return {"url": "/token/refresh", "json": {"refresh_token": ctx.setdefault("refresh_token", _new_refresh_token(ctx))}}
+
+    def keep_refresh_token(ctx, response):
+        ctx["refresh_token"] = response.json()["refresh_token"]
+
+    async def revoke(ctx):
+        return {"url": "/token/revoke", "json": {"refresh_token": _new_refresh_token(ctx)}}
+
+    async def create(ctx):
+        return {"url": "/applications", "json": {"company": "Bench Co", "position": "Engineer", "status": "applied"}, "headers": ctx["headers"]}
+
+    async def bulk(ctx):
+        rows = [{"company": f"Bulk {n}", "position": "Engineer"} for n in range(100)]
+        return {"url": "/applications/bulk", "files": {"file": ("rows.json", json.dumps(rows), "application/json")}, "headers": ctx["headers"]}
+
+    async def update(ctx):
+        ctx["updates"] += 1
+        return {"url": f"/applications/{ctx['app_id']}", "json": {"notes": f"update {ctx['updates']}"}, "headers": ctx["headers"]}
+
+    async def delete(ctx):
+        return {"url": f"/applications/{await _new_application(ctx)}", "headers": ctx["headers"]}
+
+    async def scrape(ctx):
+        ctx["scrapes"] += 1
+        return {"url": "/scrape/jobs", "params": {"query": f"benchmark {ctx['scrapes']}"}, "headers": ctx["headers"]}
+
+    async def batch(ctx):
+        # a pipeline shuffle: two new applications, a status change over several and a delete
+        ids = [await _new_application(ctx) for _ in range(5)]
+        operations = [
+            {"op": "create", "application": {"company": "Batch Co", "position": "Engineer"}},
+            {"op": "create", "application": {"company": "Batch Co", "position": "Manager"}},
+            {"op": "update", "ids": ids[:4], "changes": {"status": "rejected"}},
+            {"op": "delete", "ids": ids[4:]},
+        ]
+        return {"url": "/applications/batch", "json": {"operations": operations}, "headers": ctx["headers"]}
+
+    async def convert(ctx):
+        return {"url": f"/scraped-jobs/{ctx['job_id']}/convert", "headers": ctx["headers"]}
+
+    async def bulk_convert(ctx):
+        # twenty new jobs, one converted before and one that doesn't exist, the cost must not depend on the count
+        start = ctx["converts"] * 20
+        ctx["converts"] += 1
+        job_ids = list(ctx["unconverted"][start:start + 20]) + [ctx["job_id"], 0]
+        return {"url": "/scraped-jobs/convert", "json": {"job_ids": job_ids}, "headers": ctx["headers"]}
+
+    return [
+        RouteCase("GET", "/", 0, _get("/")),
+        RouteCase("GET", "/metrics", 0, _get("/metrics")),
+        RouteCase("POST", "/register", 3, register),
+        RouteCase("POST", "/token", 3, login),
+        RouteCase("POST", "/token/refresh", 3, refresh, after=keep_refresh_token),
+        RouteCase("POST", "/token/revoke", 2, revoke, expect=204),
+        RouteCase("POST", "/applications", 4, create, expect=201),
+        RouteCase("POST", "/applications/bulk", 3, bulk),
+        RouteCase("POST", "/applications/batch", 7, batch),
+        RouteCase("GET", "/applications", 2, _get("/applications")),
+        RouteCase("GET", "/applications/stats", 2, _get("/applications/stats")),
+        RouteCase("GET", "/applications/export", 1, _get("/applications/export")),
+        RouteCase("GET", "/applications/{app_id}", 2, _get("/applications/{app_id}")),
+        RouteCase("PUT", "/applications/{app_id}", 1, update),
+        RouteCase("DELETE", "/applications/{app_id}", 3, delete, expect=204),
+        RouteCase("GET", "/me", 0, _get("/me")),
+        RouteCase("POST", "/scrape/jobs", 3, scrape, expect=202),
+        RouteCase("GET", "/scrape/jobs/{task_id}", 1, _get("/scrape/jobs/{task_id}")),
+        RouteCase("GET", "/scraped-jobs/", 2, _get("/scraped-jobs/")),
+        RouteCase("GET", "/scraped-jobs/search", 1, _get("/scraped-jobs/search?q=python+postgres")),
+        RouteCase("GET", "/scraped-jobs/{job_id}", 2, _get("/scraped-jobs/{job_id}")),
+        RouteCase("POST", "/scraped-jobs/convert", 4, bulk_convert),
+        RouteCase("POST", "/scraped-jobs/{job_id}/convert", 4, convert),
+    ]
+
+
+def _percentile(timings: list, fraction: float) -> float:
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _result(name: str, timings: list, queries: Optional[int] = None, budget: Optional[int] = None, error: Optional[str] = None) -> dict:
+    return {
+        "name": name,
+        "p50_ms": statistics.median(timings) * 1000 if timings else None,
+        "p95_ms": _percentile(timings, 0.95) * 1000 if timings else None,
+        "queries": queries,
+        "budget": budget,
+        "error": error,
+    }
+
+
+async def run_routes(iterations: int) -> list:
+    counter = QueryCounter(get_async_engine(), get_async_read_engine())
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        token = (await client.post("/token", data={"username": BENCHMARK_EMAIL.format(0), "password": BENCHMARK_PASSWORD})).json()["access_token"]
+        ctx = {"client": client, "headers": {"Authorization": f"Bearer {token}"}, "registered": 0, "updates": 0, "scrapes": 0, "converts": 0}
+
+        db = SessionLocal()
+        try:
+            ctx["user_id"] = db.scalar(select(User.id).where(User.email == BENCHMARK_EMAIL.format(0)))
+            ctx["app_id"] = db.scalar(select(JobApplication.id).where(JobApplication.user_id == ctx["user_id"]).limit(1))
+            ctx["job_id"] = db.scalar(select(ScrapedJob.id).order_by(ScrapedJob.id).limit(1))
+            # jobs the bulk convert case hasn't converted yet, taken 20 at a time
+            ctx["unconverted"] = db.scalars(select(ScrapedJob.id).order_by(ScrapedJob.id).offset(1).limit(1000)).all()
+        finally:
+            db.close()
+        ctx["task_id"] = (await client.post("/scrape/jobs", params={"query": "benchmark setup"}, headers=ctx["headers"])).json()["id"]
+
+        results = []
+        for case in route_cases():
+            name = f"{case.method} {case.route}"
+            timings = []
+            most_queries = 0
+            error = None
+            for iteration in range(WARMUP + iterations):
+                request = await case.build(ctx)
+                counter.count = 0
+                start = time.perf_counter()
+                response = await client.request(case.method, **request)
+                elapsed = time.perf_counter() - start
+                if response.status_code != case.expect:
+                    error = f"expected {case.expect}, got {response.status_code}: {response.text[:200]}"
+                    break
+                if case.after:
+                    case.after(ctx, response)
+                # warm up fills the principal cache and the connection pool, only steady state counts
+                if iteration >= WARMUP:
+                    timings.append(elapsed)
+                    most_queries = max(most_queries, counter.count)
+            results.append(_result(name, timings, most_queries, case.budget, error))
+    return results
+
+
+def run_parser(iterations: int) -> list:
+    scraper = IndeedScraper()
+    with open(os.path.join(FIXTURES, "indeed_search.html"), "rb") as f:
+        html = f.read()
+
+    page_timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        jobs = scraper.parse_search_page(html)
+        page_timings.append(time.perf_counter() - start)
+
+    # the cards alone, without building the soup
+    from bs4 import BeautifulSoup
+    cards = BeautifulSoup(html, "lxml").find_all("div", class_="job_seen_beacon")
+    card_timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for card in cards:
+            scraper._parse_job_card(card)
+        card_timings.append((time.perf_counter() - start) / len(cards))
+
+    error = None if len(jobs) == len(cards) > 0 else f"parsed {len(jobs)} of {len(cards)} cards"
+    return [
+        _result(f"IndeedScraper.parse_search_page ({len(cards)} cards)", page_timings, error=error),
+        _result("IndeedScraper._parse_job_card (per card)", card_timings),
+    ]
+
+
+# most SQL statements the worker may run to store one chunk of scraped jobs, however many jobs it holds:
+# the insert, the bucket lookup, the bucket insert, the cluster update and the version bump
+INGEST_BUDGET = 5
+
+
+# what the scrape worker runs on the sync engine after fetching, the api routes only queue the scrape
+# each round stores the fixture page again under new urls, so every job is a repost of the round before,
+# plus a few jobs of the round before that are skipped as duplicates
+def run_ingest(iterations: int) -> list:
+    with open(os.path.join(FIXTURES, "indeed_search.html"), "rb") as f:
+        page = IndeedScraper().parse_search_page(f.read())
+    counter = QueryCounter(get_engine())
+
+    timings = []
+    most_queries = 0
+    error = None
+    previous = []
+    db = SessionLocal()
+    try:
+        for iteration in range(WARMUP + iterations):
+            jobs = [dict(job, url=f"{job['url']}&bench={time.time_ns()}") for job in page]
+            counter.count = 0
+            start = time.perf_counter()
+            inserted, duplicates = ingest_scraped_jobs(db, jobs + previous[:5])
+            elapsed = time.perf_counter() - start
+            if len(inserted) != len(jobs) or duplicates != len(previous[:5]):
+                error = f"stored {len(inserted)} of {len(jobs)} new jobs, skipped {duplicates} of {len(previous[:5])} duplicates"
+                break
+            if iteration >= WARMUP:
+                timings.append(elapsed)
+                most_queries = max(most_queries, counter.count)
+            previous = jobs
+    finally:
+        db.close()
+    return [_result(f"ingest_scraped_jobs ({len(page)} jobs + 5 duplicates)", timings, most_queries, INGEST_BUDGET, error)]
+
+
+def _time(fn, iterations: int) -> list:
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def run_auth(iterations: int) -> list:
+    token = auth.create_access_token({"sub": BENCHMARK_EMAIL.format(0)})
+    hashed = auth.get_password_hash(BENCHMARK_PASSWORD)
+    principal = auth.Principal(id=1, email=BENCHMARK_EMAIL.format(0))
+    auth.principal_cache.put(token, principal, time.time() + 60)
+    return [
+        _result("auth.create_access_token", _time(lambda: auth.create_access_token({"sub": principal.email}), iterations)),
+        _result("jwt.decode", _time(lambda: jwt.decode(token, auth.SECRET_KEY, algorithms=[auth.ALGROITHM]), iterations)),
+        _result("auth.principal_cache.get", _time(lambda: auth.principal_cache.get(token), iterations)),
+        _result("auth.create_refresh_token digest", _time(lambda: auth._refresh_token_digest(token), iterations)),
+        # bcrypt is slow on purpose, a few rounds are enough
+        _result("auth.verify_password (bcrypt)", _time(lambda: auth.verify_password(BENCHMARK_PASSWORD, hashed), min(iterations, 5))),
+    ]
+
+
+# every route in main.py needs a benchmark, a new route without one fails the suite
+def uncovered_routes() -> list:
+    covered = {(case.method, case.route) for case in route_cases()}
+    declared = {
+        (method, route.path)
+        for route in main.app.routes if isinstance(route, APIRoute)
+        for method in route.methods if method != "HEAD"
+    }
+    return sorted(f"{method} {path}" for method, path in declared - covered)
+
+
+def seed(scale: str):
+    # the api leaves the schema to alembic, a fresh benchmark database gets it straight from the models
+    Base.metadata.create_all(bind=get_engine())
+    db = SessionLocal()
+    try:
+        if db.scalar(select(User.id).where(User.email == BENCHMARK_EMAIL.format(0))) is None:
+            print(f"Seeding {scale} rows with datagen.py")
+            generate(db, SCALES[scale])
+    finally:
+        db.close()
+
+
+def report(results: list) -> bool:
+    ok = True
+    print(f"{'benchmark':<52}{'p50 ms':>10}{'p95 ms':>10}{'queries':>10}")
+    for result in results:
+        queries = "" if result["queries"] is None else f"{result['queries']}/{result['budget']}"
+        p50 = "" if result["p50_ms"] is None else f"{result['p50_ms']:.3f}"
+        p95 = "" if result["p95_ms"] is None else f"{result['p95_ms']:.3f}"
+        print(f"{result['name']:<52}{p50:>10}{p95:>10}{queries:>10}")
+        if result["error"]:
+            print(f"  FAILED: {result['error']}")
+            ok = False
+        elif result["budget"] is not None and result["queries"] > result["budget"]:
+            print(f"  FAILED: {result['queries']} queries, budget is {result['budget']}")
+            ok = False
+    return ok
+
+
+async def main_async(args) -> list:
+    try:
+        return await run_routes(args.iterations)
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the api and fail on query count regressions")
+    parser.add_argument("--scale", choices=SCALES, default="1k", help="rows to seed when the database has no benchmark data")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    # rate limits would turn the timing loops into 429s
+    main.limiter.enabled = False
+
+    seed(args.scale)
+    results = asyncio.run(main_async(args)) + run_ingest(args.iterations) + run_parser(args.iterations) + run_auth(args.iterations)
+    missing = uncovered_routes()
+    for route in missing:
+        results.append(_result(route, [], error="route has no benchmark in benchmarks/suite.py"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(0 if report(results) else 1)
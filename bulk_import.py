@@ -0,0 +1,84 @@
+import codecs
+import csv
+import io
+import json
+from typing import BinaryIO, Iterator
+
+# bytes read from the upload at a time
+READ_SIZE = 64 * 1024
+# a decode error this close to the end of what was read may just be a token cut off by the read, e.g. "fals" or "\u00"
+CUT_TOKEN_TAIL = 8
+# characters a number may continue with, "1" followed by "." or "e" at the end of the buffer isn't finished yet
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+# yields the elements of a top level JSON array one at a time
+# only the element currently being decoded is held in memory, not the whole upload
+def iter_json_array(fileobj: BinaryIO, read_size: int = READ_SIZE) -> Iterator:
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer, pos = "", 0
+    expect = "open"
+    eof = False
+
+    while True:
+        while pos < len(buffer) and buffer[pos].isspace():
+            pos += 1
+
+        # need more input, drop what was already consumed before appending
+        if pos == len(buffer) or expect == "more":
+            if eof:
+                raise ValueError("Unexpected end of JSON array")
+            chunk = fileobj.read(read_size)
+            eof = not chunk
+            buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+            pos = 0
+            if expect == "more":
+                expect = "value"
+            continue
+
+        char = buffer[pos]
+        if expect == "open":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            pos += 1
+            expect = "first"
+        elif expect in ("first", "value"):
+            if char == "]" and expect == "first":
+                return
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                # only an element that runs past what was read needs more input, anything else fails right away
+                # instead of reading the rest of the upload first
+                cut_off = e.msg.startswith("Unterminated string") or len(buffer) - e.pos <= CUT_TOKEN_TAIL
+                if eof or not cut_off:
+                    raise ValueError(f"Malformed JSON: {e.msg}")
+                expect = "more"
+                continue
+            # a bare number may have been cut off mid read, right after a digit, "." or "e"
+            is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if not eof and (end == len(buffer) or (is_number and not buffer[end:].lstrip(NUMBER_CHARS))):
+                expect = "more"
+                continue
+            yield value
+            pos = end
+            expect = "separator"
+        else:
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or ']' between array elements")
+            pos += 1
+            expect = "value"
+
+
+# yields csv rows as dicts keyed by the header row, empty cells are left out so schema defaults apply
+def iter_csv_rows(fileobj: BinaryIO) -> Iterator[dict]:
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        for row in csv.DictReader(text):
+            yield {key: value for key, value in row.items() if key and value not in ("", None)}
+    finally:
+        # leave the upload open for whoever owns it
+        text.detach()
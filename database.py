@@ -1,30 +1,207 @@
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, Text, DateTime, Enum as SQLEnum
+from sqlalchemy import create_engine, event, update, DDL, Column, Integer, BigInteger, String, ForeignKey, Text, Date, DateTime, Index, JSON, LargeBinary, Enum as SQLEnum
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker, relationship, deferred
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from datetime import datetime
-from schemas import ApplicationStatus
+from typing import Optional
+from schemas import ApplicationStatus, ScrapeTaskStatus
+from metrics import registry, record_query, db_pool_wait, CallbackMetric
+from diagnostics import DB_DIAGNOSTICS, inspect_query
 
 load_dotenv()
 
+# checked when the first engine is created, not on import
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-if DATABASE_URL is None:
-    raise ValueError("DATABASE_URL not found in environment variables!")
+# async drivers used by the api for each backend
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+# the same database url with its driver swapped for the async one
+def async_database_url(url: str) -> URL:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        raise ValueError(f"No async driver for {parsed.get_backend_name()} databases")
+    return parsed.set(drivername=driver)
+
+# connection pool settings, applied to every engine
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# connections older than this many seconds are replaced, keeps them under server and proxy idle timeouts
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# checks a connection is still alive before handing it out
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# optional read replica for the read only endpoints
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+# seconds after a user's own write during which their reads still go to the primary, cover the replica lag
+READ_YOUR_WRITES_WINDOW = float(os.getenv("READ_YOUR_WRITES_WINDOW", "5"))
+
+# queue pool that reports how long each checkout waited, for a free connection or for a new one to connect
+def timed_pool(base, engine_name: str):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            db_pool_wait.observe(time.perf_counter() - start, engine_name)
+    return type(f"Timed{base.__name__}", (base,), {"_do_get": _do_get})
+
+def engine_options(url, poolclass=None) -> dict:
+    options = {"pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    parsed = make_url(url)
+    # in memory sqlite doesn't use a queue pool, so there is nothing to size
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return options
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    if poolclass is not None:
+        options["poolclass"] = poolclass
+    return options
+
+# times every statement, the totals also go to the request running it so slow routes show their db share
+# with DB_DIAGNOSTICS on, slow statements are logged and repeated ones counted, see diagnostics.py
+def instrument_engine(engine, engine_name: str):
+    @event.listens_for(engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        context.query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - context.query_started
+        record_query(engine_name, seconds)
+        if DB_DIAGNOSTICS:
+            inspect_query(conn, statement, parameters, executemany, seconds)
+
+# engines are created on first use, so importing the models or the app needs neither a database nor its driver
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _create_engine(engine_name: str):
+    if DATABASE_URL is None:
+        raise ValueError("DATABASE_URL not found in environment variables!")
+    if engine_name == "sync":
+        return create_engine(DATABASE_URL, **engine_options(DATABASE_URL, timed_pool(QueuePool, "sync")))
+    url = DATABASE_READ_URL if engine_name == "replica" else DATABASE_URL
+    return create_async_engine(async_database_url(url), **engine_options(url, timed_pool(AsyncAdaptedQueuePool, engine_name)))
+
+def _get_engine(engine_name: str):
+    engine = _engines.get(engine_name)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(engine_name)
+            if engine is None:
+                engine = _create_engine(engine_name)
+                # event hooks and pools live on the sync side of async engines
+                instrument_engine(getattr(engine, "sync_engine", engine), engine_name)
+                _engines[engine_name] = engine
+    return engine
+
+# sync engine, used by alembic, scripts and the scrape workers
+def get_engine():
+    return _get_engine("sync")
+
+# async engine for the api, requests wait on the database without holding a thread
+def get_async_engine():
+    return _get_engine("primary")
+
+# without a replica reads just use the primary
+def get_async_read_engine():
+    return _get_engine("replica") if DATABASE_READ_URL else get_async_engine()
+
+# closes the pooled connections of every engine created so far, they reconnect if used again
+async def dispose_engines():
+    for engine in list(_engines.values()):
+        if hasattr(engine, "sync_engine"):
+            await engine.dispose()
+        else:
+            engine.dispose()
+
+# session factory that binds itself to its engine the first time a session is made
+class LazySessionmaker:
+    def __init__(self, factory, get_bind, **options):
+        self.factory = factory
+        self.get_bind = get_bind
+        self.options = options
+        self._sessionmaker = None
+
+    def __call__(self, **kwargs):
+        if self._sessionmaker is None:
+            self._sessionmaker = self.factory(bind=self.get_bind(), **self.options)
+        return self._sessionmaker(**kwargs)
+
+SessionLocal = LazySessionmaker(sessionmaker, get_engine, autocommit=False, autoflush=False)
+# objects stay loaded after commit, lazy loading them again isn't possible outside an await
+AsyncSessionLocal = LazySessionmaker(async_sessionmaker, get_async_engine, autoflush=False, expire_on_commit=False)
+AsyncReadSessionLocal = LazySessionmaker(async_sessionmaker, get_async_read_engine, autoflush=False, expire_on_commit=False)
+
+# connections in use right now, pools without a queue (in memory sqlite) have nothing to report
+def _pool_checked_out() -> dict:
+    pools = {engine_name: getattr(engine, "sync_engine", engine).pool for engine_name, engine in list(_engines.items())}
+    return {(engine_name, ): pool.checkedout() for engine_name, pool in pools.items() if hasattr(pool, "checkedout")}
+
+registry.register(CallbackMetric("db_pool_checked_out", "Pooled connections in use, by engine.", ("engine",), _pool_checked_out))
+
+# the schema is managed by alembic, this compares the database's revision with the newest migration
+# returns what is wrong, or None when the database is up to date
+def schema_revision_problem() -> Optional[str]:
+    from alembic.config import Config
+    from alembic.runtime.migration import MigrationContext
+    from alembic.script import ScriptDirectory
+    here = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(here, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(here, "alembic"))
+    expected = set(ScriptDirectory.from_config(config).get_heads())
+    with get_engine().connect() as connection:
+        current = set(MigrationContext.configure(connection).get_current_heads())
+    if current == expected:
+        return None
+    return (f"Database schema is at revision {', '.join(sorted(current)) or 'none'}, "
+            f"the code expects {', '.join(sorted(expected))}. Run alembic upgrade head")
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_replica_db():
+    async with AsyncReadSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
+# users who wrote in the last `window` seconds, their reads go to the primary so they see their own changes
+# kept per process, a client routed to another api process can still read from a lagging replica
+class RecentWriters:
+    def __init__(self, window: float = READ_YOUR_WRITES_WINDOW):
+        self.window = window
+        self._until = {}
+        self._lock = threading.Lock()
+
+    def mark(self, user_id: int):
+        now = time.monotonic()
+        with self._lock:
+            self._until[user_id] = now + self.window
+            # drop expired marks once in a while so the dict doesn't grow with every user ever seen
+            if len(self._until) > 10000:
+                self._until = {uid: until for uid, until in self._until.items() if until > now}
+
+    def is_recent(self, user_id: int) -> bool:
+        with self._lock:
+            return self._until.get(user_id, 0) > time.monotonic()
+
+
+recent_writers = RecentWriters()
+
 # user model
 class User(Base):
     __tablename__ = "users"
@@ -56,6 +233,30 @@ class JobApplication(Base):
     # each application belongs to one user
     user = relationship("User", back_populates="applications")
 
+    # backs the keyset pagination on GET /applications
+    __table_args__ = (
+        Index("ix_applications_user_id_updated_at_id", "user_id", "updated_at", "id"),
+        # one application per posting, converting a scraped job twice is skipped by the database, see convert_scraped_jobs
+        # applications without a url are never duplicates of each other
+        Index("uq_applications_user_id_job_url", "user_id", "job_url", unique=True),
+    )
+
+# per user counters behind GET /applications/stats, kept in step with applications in the same transaction, see stats.py
+class ApplicationStatusCount(Base):
+    __tablename__ = "application_status_counts"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(SQLEnum(ApplicationStatus), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+# applications created per week, week_start is the monday
+class ApplicationWeeklyCount(Base):
+    __tablename__ = "application_weekly_counts"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    week_start = Column(Date, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
 class ScrapedJob(Base):
     __tablename__ = "scraped_jobs"
 
@@ -68,10 +269,120 @@ class ScrapedJob(Base):
     posted_date = Column(DateTime, nullable=True)
     source = Column(String, nullable=False)
     scraped_at = Column(DateTime, default=datetime.now)
+    minhash = deferred(Column(LargeBinary, nullable=True)) # near duplicate signature, see dedup.py
+    cluster_id = Column(Integer, nullable=True, index=True) # id of the earlier posting this one reposts, null if it is the first
+
+    # backs the keyset pagination on GET /scraped-jobs/ with and without a source filter
+    __table_args__ = (
+        Index("ix_scraped_jobs_scraped_at_id", "scraped_at", "id"),
+        Index("ix_scraped_jobs_source_scraped_at_id", "source", "scraped_at", "id"),
+    )
+
+# LSH band buckets of each scraped job's signature, used to find near duplicates without scanning every job
+class ScrapedJobBucket(Base):
+    __tablename__ = "scraped_job_buckets"
+
+    bucket = Column(BigInteger, primary_key=True)
+    job_id = Column(Integer, ForeignKey("scraped_jobs.id", ondelete="CASCADE"), primary_key=True, index=True)
+
+# full text search over scraped jobs, title matches rank above company and company above description
+# postgres keeps a weighted tsvector in a generated column behind a GIN index
+SCRAPED_JOBS_SEARCH_DDL_POSTGRES = [
+    """ALTER TABLE scraped_jobs ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(company, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED""",
+    "CREATE INDEX ix_scraped_jobs_search_vector ON scraped_jobs USING GIN (search_vector)",
+]
+# sqlite falls back to an external content FTS5 table kept in sync by triggers
+SCRAPED_JOBS_SEARCH_DDL_SQLITE = [
+    "CREATE VIRTUAL TABLE scraped_jobs_fts USING fts5(title, company, description, content='scraped_jobs', content_rowid='id')",
+    """CREATE TRIGGER scraped_jobs_fts_insert AFTER INSERT ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(rowid, title, company, description) VALUES (new.id, new.title, new.company, new.description);
+    END""",
+    """CREATE TRIGGER scraped_jobs_fts_delete AFTER DELETE ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(scraped_jobs_fts, rowid, title, company, description) VALUES ('delete', old.id, old.title, old.company, old.description);
+    END""",
+    """CREATE TRIGGER scraped_jobs_fts_update AFTER UPDATE OF title, company, description ON scraped_jobs BEGIN
+        INSERT INTO scraped_jobs_fts(scraped_jobs_fts, rowid, title, company, description) VALUES ('delete', old.id, old.title, old.company, old.description);
+        INSERT INTO scraped_jobs_fts(rowid, title, company, description) VALUES (new.id, new.title, new.company, new.description);
+    END""",
+]
+# schema objects that only exist for search, hidden from alembic autogenerate
+# fts5 also creates shadow tables named scraped_jobs_fts_*
+SEARCH_SCHEMA_NAMES = {"search_vector", "ix_scraped_jobs_search_vector", "scraped_jobs_fts"}
+
+for statement in SCRAPED_JOBS_SEARCH_DDL_POSTGRES:
+    event.listen(ScrapedJob.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in SCRAPED_JOBS_SEARCH_DDL_SQLITE:
+    event.listen(ScrapedJob.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+
+# change counters behind list ETags, for changes a newer id or a row count doesn't show (purges, cluster reassignments)
+# writers bump theirs with bump_data_version in the same transaction as the change
+class DataVersion(Base):
+    __tablename__ = "data_versions"
+
+    name = Column(String, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
+SCRAPED_JOBS_VERSION = "scraped_jobs"
+
+event.listen(DataVersion.__table__, "after_create", DDL(f"INSERT INTO data_versions (name, version) VALUES ('{SCRAPED_JOBS_VERSION}', 0)"))
+
+# locks the counter row until the commit, call it right before committing
+def bump_data_version(db, name: str):
+    db.execute(update(DataVersion).where(DataVersion.name == name).values(version=DataVersion.version + 1))
+
+# a scrape waiting for, or being run by, the background workers
+class ScrapeTask(Base):
+    __tablename__ = "scrape_tasks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    query = Column(String, nullable=False)
+    location = Column(String, nullable=False, default="")
+    max_results = Column(Integer, nullable=False)
+    sources = Column(JSON, nullable=False) # names of the scrapers to fan out to
+    dedupe_key = Column(String, nullable=False) # identical requests from one user share a key
+    status = Column(SQLEnum(ScrapeTaskStatus), nullable=False, default=ScrapeTaskStatus.PENDING)
+    attempts = Column(Integer, nullable=False, default=0)
+    scraped = Column(Integer, nullable=False, default=0)
+    inserted = Column(Integer, nullable=False, default=0)
+    duplicates = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    next_attempt_at = Column(DateTime, default=datetime.now) # pushed back after a failed attempt
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # workers look for the oldest due task
+        Index("ix_scrape_tasks_status_next_attempt_at", "status", "next_attempt_at"),
+        # at most one queued or running task per identical request
+        Index(
+            "uq_scrape_tasks_active_dedupe_key", "dedupe_key", unique=True,
+            postgresql_where=status.in_([ScrapeTaskStatus.PENDING, ScrapeTaskStatus.RUNNING]),
+            sqlite_where=status.in_([ScrapeTaskStatus.PENDING, ScrapeTaskStatus.RUNNING])
+        ),
+    )
+
+# long lived token used to get new access tokens without logging in again
+# only a sha256 digest is stored, each use revokes it and issues the next token of the same family
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True)
+    family_id = Column(String(32), nullable=False, index=True) # shared by every token rotated from the same login
+    created_at = Column(DateTime, default=datetime.now)
+    expires_at = Column(DateTime, nullable=False, index=True) # retention.py deletes rows past it
+    revoked_at = Column(DateTime, nullable=True) # set once the token was used or revoked
 
 # creates the table in the db
 def init_db():
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,148 @@
+import hashlib
+import random
+import re
+import struct
+from typing import Dict, List, Optional, Sequence
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+from database import ScrapedJob, ScrapedJobBucket, SCRAPED_JOBS_VERSION, bump_data_version
+
+# near duplicate detection for reposted jobs
+# every job gets a MinHash signature over word shingles of its title, company and description,
+# the signature is split into bands and each band is stored as a bucket so look-alikes are found by index lookup
+
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = 3
+# estimated jaccard similarity at or above which two postings count as the same job
+SIMILARITY_THRESHOLD = 0.8
+
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# fixed seed, signatures stored in the database have to stay comparable across processes and restarts
+_rng = random.Random(20261017)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERMUTATIONS)]
+_SIGNATURE_FORMAT = f"<{NUM_PERMUTATIONS}I"
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def shingles(title: str, company: str, description: Optional[str]) -> set:
+    tokens = re.findall(r"[a-z0-9]+", " ".join([title or "", company or "", description or ""]).lower())
+    if len(tokens) < SHINGLE_SIZE:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + SHINGLE_SIZE]) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def signature(title: str, company: str, description: Optional[str]) -> bytes:
+    hashes = [_hash64(shingle.encode()) for shingle in shingles(title, company, description)]
+    minimums = [min(((a * h + b) % _PRIME) & _MAX_HASH for h in hashes) for a, b in _PERMUTATIONS]
+    return struct.pack(_SIGNATURE_FORMAT, *minimums)
+
+
+def similarity(first: bytes, second: bytes) -> float:
+    a = struct.unpack(_SIGNATURE_FORMAT, first)
+    b = struct.unpack(_SIGNATURE_FORMAT, second)
+    return sum(x == y for x, y in zip(a, b)) / NUM_PERMUTATIONS
+
+
+# one bucket per band, the band number is part of the hash so a single indexed column covers every band
+def buckets(job_signature: bytes) -> List[int]:
+    band_size = ROWS_PER_BAND * 4
+    return [
+        int.from_bytes(hashlib.blake2b(bytes([band]) + job_signature[band * band_size:(band + 1) * band_size], digest_size=8).digest(), "little", signed=True)
+        for band in range(BANDS)
+    ]
+
+
+# puts each newly stored job in the cluster of its closest earlier look-alike, or leaves it as its own cluster
+# jobs carry id, minhash and cluster_id, returns job id -> cluster id for the members
+def assign_clusters(db: Session, jobs: Sequence) -> Dict[int, int]:
+    # oldest first so the first posting becomes the cluster id, postgres doesn't keep multi row RETURNING in insert order
+    jobs = sorted((job for job in jobs if job.minhash is not None), key=lambda job: job.id)
+    if not jobs:
+        return {}
+    job_buckets = {job.id: buckets(job.minhash) for job in jobs}
+
+    # one indexed lookup for every bucket the new jobs fall into
+    signatures = {}
+    clusters = {}
+    bucket_index: Dict[int, List[int]] = {}
+    wanted = {bucket for values in job_buckets.values() for bucket in values}
+    candidates = db.execute(
+        select(ScrapedJobBucket.bucket, ScrapedJob.id, ScrapedJob.minhash, ScrapedJob.cluster_id)
+        .join(ScrapedJob, ScrapedJob.id == ScrapedJobBucket.job_id)
+        .where(ScrapedJobBucket.bucket.in_(wanted))
+    )
+    for bucket, job_id, minhash, cluster_id in candidates:
+        signatures[job_id] = minhash
+        clusters[job_id] = cluster_id or job_id
+        bucket_index.setdefault(bucket, []).append(job_id)
+
+    members = {}
+    for job in jobs:
+        best_id, best_score = None, SIMILARITY_THRESHOLD
+        seen = set()
+        for bucket in job_buckets[job.id]:
+            for candidate_id in bucket_index.get(bucket, ()):
+                if candidate_id in seen:
+                    continue
+                seen.add(candidate_id)
+                score = similarity(job.minhash, signatures[candidate_id])
+                if score >= best_score:
+                    best_id, best_score = candidate_id, score
+
+        clusters[job.id] = clusters[best_id] if best_id is not None else job.id
+        if best_id is not None:
+            members[job.id] = clusters[best_id]
+        # later jobs in the same batch can match this one
+        signatures[job.id] = job.minhash
+        for bucket in job_buckets[job.id]:
+            bucket_index.setdefault(bucket, []).append(job.id)
+
+    db.execute(insert(ScrapedJobBucket), [
+        {"bucket": bucket, "job_id": job_id}
+        for job_id, values in job_buckets.items() for bucket in set(values)
+    ])
+    if members:
+        db.execute(update(ScrapedJob), [{"id": job_id, "cluster_id": cluster_id} for job_id, cluster_id in members.items()])
+    return members
+
+
+# signs and clusters jobs stored before near duplicate detection existed, oldest first
+def backfill(db: Session, batch_size: int = 500) -> int:
+    done = 0
+    last_id = 0
+    while True:
+        batch = db.execute(
+            select(ScrapedJob.id, ScrapedJob.title, ScrapedJob.company, ScrapedJob.description)
+            .where(ScrapedJob.minhash.is_(None), ScrapedJob.id > last_id)
+            .order_by(ScrapedJob.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return done
+
+        signed = [{"id": job.id, "minhash": signature(job.title, job.company, job.description)} for job in batch]
+        db.execute(update(ScrapedJob), signed)
+        assign_clusters(db, db.execute(
+            select(ScrapedJob.id, ScrapedJob.minhash, ScrapedJob.cluster_id)
+            .where(ScrapedJob.id.in_([job.id for job in batch]))
+            .order_by(ScrapedJob.id)
+        ).all())
+        bump_data_version(db, SCRAPED_JOBS_VERSION)
+        db.commit()
+        done += len(batch)
+        last_id = batch[-1].id
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        print(f"Signed {backfill(session)} scraped jobs")
+    finally:
+        session.close()
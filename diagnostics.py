@@ -0,0 +1,94 @@
+import logging
+import os
+import re
+from metrics import current_request_db, route_label
+
+# opt in query diagnostics, DB_DIAGNOSTICS=true turns them on
+# logs statements slower than SLOW_QUERY_MS with their parameters redacted and the route that ran them,
+# and flags requests that run the same statement shape more than N_PLUS_ONE_THRESHOLD times, the mark of an N+1 loop
+
+logger = logging.getLogger(__name__)
+
+DB_DIAGNOSTICS = os.getenv("DB_DIAGNOSTICS", "false").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+# postgres only, logs the plan of each slow statement, costs one more round trip per slow statement
+EXPLAIN_SLOW_QUERIES = os.getenv("EXPLAIN_SLOW_QUERIES", "false").lower() in ("1", "true", "yes")
+
+# placeholders of every paramstyle the drivers use, a run of them is one IN list or VALUES row
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)"
+_PLACEHOLDER_RUN = re.compile(rf"{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})+")
+_VALUES_RUN = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+# plans are only asked for statements EXPLAIN accepts
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+# the statement with its IN lists and multi row VALUES collapsed, so the same query with more ids has the same shape
+def statement_shape(statement: str) -> str:
+    shape = _PLACEHOLDER_RUN.sub("?, ...", _WHITESPACE.sub(" ", statement).strip())
+    return _VALUES_RUN.sub("(?, ...), ...", shape)
+
+
+# parameter values can be passwords, tokens or personal data, only their types are logged
+def redact(parameters):
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"<{len(parameters)} parameter sets>"
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+def _origin() -> str:
+    stats = current_request_db.get()
+    if stats is None or stats.scope is None:
+        return "outside a request"
+    return f"{stats.scope['method']} {route_label(stats.scope)}"
+
+
+# EXPLAIN on a cursor of its own, the statement's cursor still holds rows the caller hasn't fetched
+# a savepoint keeps a failed EXPLAIN from aborting the caller's transaction
+def _explain(conn, statement: str, parameters) -> str:
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute("SAVEPOINT diagnostics_explain")
+        try:
+            cursor.execute(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        except Exception as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT diagnostics_explain")
+            plan = f"EXPLAIN failed: {e}"
+        cursor.execute("RELEASE SAVEPOINT diagnostics_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+# called by the engine hooks in database.py after every statement while diagnostics are on
+def inspect_query(conn, statement: str, parameters, executemany: bool, seconds: float):
+    stats = current_request_db.get()
+    if stats is not None:
+        stats.shapes[statement_shape(statement)] += 1
+
+    milliseconds = seconds * 1000
+    if milliseconds < SLOW_QUERY_MS:
+        return
+    logger.warning(
+        f"Slow query ({milliseconds:.1f} ms) from {_origin()}: {_WHITESPACE.sub(' ', statement).strip()} "
+        f"parameters={redact(parameters)}"
+    )
+    if (EXPLAIN_SLOW_QUERIES and conn.dialect.name == "postgresql" and not executemany
+            and statement.lstrip().lower().startswith(_EXPLAINABLE)):
+        logger.warning(f"Plan of the slow query:\n{_explain(conn, statement, parameters)}")
+
+
+# called once a request finished, logs every statement shape it repeated too often
+def check_repeated_statements(stats):
+    repeated = [(shape, count) for shape, count in stats.shapes.items() if count > N_PLUS_ONE_THRESHOLD]
+    for shape, count in sorted(repeated, key=lambda item: -item[1]):
+        logger.warning(
+            f"Possible N+1 in {stats.scope['method']} {route_label(stats.scope)}: "
+            f"ran {count} times (threshold {N_PLUS_ONE_THRESHOLD}): {shape}"
+        )
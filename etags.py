@@ -0,0 +1,34 @@
+import hashlib
+from fastapi import Request, Response, status
+
+# conditional GET support
+# etags are built from a few cheap values that change whenever the response would (row counts, last update times),
+# never from the serialized body, so a 304 costs one small query and no row loading or serialization
+
+
+def weak_etag(*parts) -> str:
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=12).hexdigest()
+    return f'W/"{digest}"'
+
+
+# weak comparison as in RFC 9110, the W/ prefix is ignored on both sides
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in header.split(",")}
+
+
+# the responses depend on who is asking, shared caches must not hand them to someone else
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+
+
+def set_etag(response: Response, etag: str):
+    response.headers.update(etag_headers(etag))
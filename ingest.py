@@ -0,0 +1,84 @@
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+from sqlalchemy import insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from database import ScrapedJob, SCRAPED_JOBS_VERSION, bump_data_version
+from dedup import assign_clusters, signature
+
+# scraped jobs written per INSERT statement
+INGEST_CHUNK_SIZE = 500
+
+scraped_jobs_table = ScrapedJob.__table__
+
+# dialects that support INSERT ... ON CONFLICT DO NOTHING RETURNING
+UPSERT_INSERTS = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+def chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# inserts the rows whose url is not stored yet and returns only those rows
+def _insert_new_jobs(db: Session, rows: List[dict]) -> List[Row]:
+    dialect_insert = UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if dialect_insert is not None:
+        stmt = (
+            dialect_insert(scraped_jobs_table)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=["url"])
+            .returning(*scraped_jobs_table.c)
+        )
+        return list(db.execute(stmt))
+
+    # other backends, one lookup for the whole chunk then a plain multi row insert
+    existing = set(db.scalars(select(ScrapedJob.url).where(ScrapedJob.url.in_([row["url"] for row in rows]))))
+    new_rows = [row for row in rows if row["url"] not in existing]
+    if not new_rows:
+        return []
+    return list(db.execute(insert(scraped_jobs_table).values(new_rows).returning(*scraped_jobs_table.c)))
+
+
+# writes scraped jobs in chunks, one statement and one commit per chunk
+# returns the newly stored rows and how many jobs were skipped as duplicates
+def ingest_scraped_jobs(db: Session, jobs: Iterable[dict], chunk_size: int = INGEST_CHUNK_SIZE) -> Tuple[List[Row], int]:
+    inserted = []
+    duplicates = 0
+
+    for chunk in chunked(jobs, chunk_size):
+        scraped_at = datetime.now()
+        rows = {}
+        for job_data in chunk:
+            # the same posting can show up twice in one scrape
+            if job_data["url"] in rows:
+                duplicates += 1
+                continue
+            rows[job_data["url"]] = {
+                "title": job_data["title"],
+                "company": job_data["company"],
+                "location": job_data.get("location"),
+                "url": job_data["url"],
+                "description": job_data.get("description"),
+                "posted_date": job_data.get("posted_date"),
+                "source": job_data["source"],
+                "scraped_at": scraped_at,
+                "minhash": signature(job_data["title"], job_data["company"], job_data.get("description")),
+            }
+
+        new_jobs = _insert_new_jobs(db, list(rows.values()))
+        # reposts of a job we already have join its cluster in the same transaction
+        assign_clusters(db, new_jobs)
+        if new_jobs:
+            bump_data_version(db, SCRAPED_JOBS_VERSION)
+        db.commit()
+        duplicates += len(rows) - len(new_jobs)
+        inserted.extend(new_jobs)
+
+    return inserted, duplicates
@@ -1,58 +1,130 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, status, Request, Response, Query, UploadFile, File
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse, ORJSONResponse, PlainTextResponse
+from fastapi.concurrency import run_in_threadpool
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
-from sqlalchemy.orm import Session
-from datetime import timedelta
-from database import SessionLocal, JobApplication, User, Base, engine, ScrapedJob
-from typing import Optional
+from sqlalchemy import select, insert, update, delete, func, or_, and_, cast, literal
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from datetime import datetime, timedelta
+from database import get_db, AsyncSessionLocal, AsyncReadSessionLocal, dispose_engines, schema_revision_problem, recent_writers, JobApplication, User, ScrapedJob, ScrapeTask, ApplicationStatusCount, ApplicationWeeklyCount, DataVersion, SCRAPED_JOBS_VERSION
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import csv
+import io
+import json
+import os
+import secrets
+import time
+from itertools import groupby, islice
+from collections import Counter
 from auth import (
-    get_password_hash, 
-    verify_password, 
-    create_access_token, 
+    get_password_hash_async,
+    verify_and_update_password_async,
+    create_access_token,
+    create_refresh_token,
+    rotate_refresh_token,
+    revoke_refresh_token,
     get_current_user,
+    Principal,
     ACCESS_TOKEN_EXPIRE_MINUTES
 )
-from scraper import IndeedScraper, MockScraper
+from pagination import paginate, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from search import search_scraped_jobs
+from stats import StatsDelta, apply_stats, week_start
+from ingest import UPSERT_INSERTS
+from etags import weak_etag, etag_matches, etag_headers, not_modified, set_etag
+from serialization import parse_fields, rows_to_dicts
+from bulk_import import iter_json_array, iter_csv_rows
+from worker import ScrapeWorkerPool, SCRAPE_WORKERS, task_dedupe_key
+from passwords import PasswordHasherBusy, shutdown_pool
+from metrics import registry, RequestDBStats, current_request_db, record_request, route_label, server_timing, SERVER_TIMING, METRICS_TOKEN
+from diagnostics import DB_DIAGNOSTICS, check_repeated_statements
+from ratelimit import RATELIMIT_STORAGE_URL
 from schemas import (
-    UserCreate, UserResponse, Token,
+    UserCreate, UserResponse, Token, RefreshTokenRequest,
     ApplicationCreate, ApplicationUpdate, ApplicationResponse, ApplicationListResponse, ApplicationStatus,
-    ScrapedJobResponse, ScrapedJobListResponse
+    BulkImportResponse, ApplicationStats, BatchRequest, BatchResponse, BatchResult,
+    ScrapedJobResponse, ScrapedJobListResponse, ScrapeTaskResponse, ScrapeTaskStatus,
+    ConvertRequest, ConvertResponse, ConvertedJob
 )
 
-# creates the tables if they don't exist
-Base.metadata.create_all(bind=engine)
-
-app = FastAPI(title="Job Application Tracker API")
-
-# rate limiting
-limiter = Limiter(key_func=get_remote_address, default_limits=["100/minute"])
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# fails startup when the database is behind the migrations, the schema itself is managed by alembic
+SCHEMA_CHECK = os.getenv("SCHEMA_CHECK", "false").lower() in ("1", "true", "yes")
+
+# scrapes run on a background worker pool so they never hold an api thread
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if SCHEMA_CHECK:
+        problem = await run_in_threadpool(schema_revision_problem)
+        if problem:
+            raise RuntimeError(problem)
+    workers = ScrapeWorkerPool(SCRAPE_WORKERS)
+    workers.start()
+    yield
+    workers.stop(timeout=5)
+    shutdown_pool()
+    await dispose_engines()
+
+# rate limiting, counters are kept in RATELIMIT_STORAGE_URL so every worker process shares them, see ratelimit.py
+limiter = Limiter(key_func=get_remote_address, default_limits=["100/minute"], storage_uri=RATELIMIT_STORAGE_URL)
+
+# bcrypt runs on a bounded process pool, when it is full fail fast instead of piling up logins
+def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many logins in progress, try again shortly"},
+        headers={"Retry-After": "1"}
+    )
 
-# dependency to get database session
-def get_db():
-    db = SessionLocal()
+# requests that may write, after one succeeds the user reads from the primary for a while
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+async def track_recent_writers(request: Request, call_next):
+    response = await call_next(request)
+    principal = getattr(request.state, "principal", None)
+    if principal is not None and request.method in WRITE_METHODS and response.status_code < 400:
+        recent_writers.mark(principal.id)
+    return response
+
+# latency, status and db time per route, added last so it wraps every other middleware
+async def record_metrics(request: Request, call_next):
+    db_stats = RequestDBStats(request.scope)
+    # the engine hooks add every statement run inside this request to db_stats
+    context_token = current_request_db.set(db_stats)
+    start = time.perf_counter()
     try:
-        yield db
+        response = await call_next(request)
+    except Exception:
+        record_request(request.method, route_label(request.scope), 500, time.perf_counter() - start, db_stats)
+        raise
     finally:
-        db.close()
+        current_request_db.reset(context_token)
+        if DB_DIAGNOSTICS:
+            check_repeated_statements(db_stats)
+    elapsed = time.perf_counter() - start
+    record_request(request.method, route_label(request.scope), response.status_code, elapsed, db_stats)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = server_timing(elapsed, db_stats)
+    return response
+
+# dependency for read only endpoints, uses the replica unless the user just wrote something it may not have yet
+async def get_read_db(current_user: Principal = Depends(get_current_user)):
+    session_factory = AsyncSessionLocal if recent_writers.is_recent(current_user.id) else AsyncReadSessionLocal
+    async with session_factory() as db:
+        yield db
+
+router = APIRouter()
 
 # PUBLIC ENDPOINTS
 
 # root endpoint
-@app.get("/")
-def read_root():
+@router.get("/")
+async def read_root():
     return {"message": "Job Application Tracker API", 
             "docs": "/docs",
             "endpoints": {
@@ -62,43 +134,59 @@ def read_root():
             }}
 
 
+# prometheus scrape target
+@router.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    if METRICS_TOKEN and not secrets.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
 # register a new user
-@app.post("/register", response_model=UserResponse)
+@router.post("/register", response_model=UserResponse)
 @limiter.limit("5/minute")
-def register(request: Request, user: UserCreate, db: Session = Depends(get_db)):
+async def register(request: Request, user: UserCreate, db: AsyncSession = Depends(get_db)):
     # check if user already exists
-    existing_user = db.query(User).filter(User.email == user.email).first()
+    existing_user = await db.scalar(select(User.id).where(User.email == user.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email is already registered"
         )
     
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     new_user = User(email=user.email, hashed_password=hashed_password)
 
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
 
     return new_user
     
 
 
 # login and get access token
-@app.post("/token", response_model=Token)
+@router.post("/token", response_model=Token)
 @limiter.limit("10/minute")
-def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     # find user by email
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = await db.scalar(select(User).where(User.email == form_data.username))
 
     # verify user exists and the password is correct
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    valid, new_hash = await verify_and_update_password_async(form_data.password, user.hashed_password) if user else (False, None)
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"}
         )
+
+    # hashes made with an older bcrypt cost are upgraded now that we have the plain password
+    if new_hash:
+        user.hashed_password = new_hash
+
+    refresh_token = create_refresh_token(db, user.id)
+    await db.commit()
     
     # create access token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -109,16 +197,44 @@ def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db
 
     return {
         "access_token": access_token,
-        "token_type": "bearer"
+        "token_type": "bearer",
+        "refresh_token": refresh_token
     }
 
 
+# get a new access token without the password, the refresh token is rotated on every call
+@router.post("/token/refresh", response_model=Token)
+@limiter.limit("30/minute")
+async def refresh_access_token(request: Request, body: RefreshTokenRequest, db: AsyncSession = Depends(get_db)):
+    email, refresh_token = await rotate_refresh_token(db, body.refresh_token)
+    access_token = create_access_token(
+        data={"sub": email},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "refresh_token": refresh_token
+    }
+
+
+# log out, revokes the refresh token and every token rotated from the same login
+@router.post("/token/revoke", status_code=status.HTTP_204_NO_CONTENT)
+@limiter.limit("30/minute")
+async def revoke_token(request: Request, body: RefreshTokenRequest, db: AsyncSession = Depends(get_db)):
+    await revoke_refresh_token(db, body.refresh_token)
+
+
 # PROTECTED ENDPOINTS (AUTH REQUIRED)
 
+# a user tracks each job posting once, see the unique index on applications
+DUPLICATE_JOB_URL = "You already have an application for this job URL"
+
 # add a new job application
-@app.post("/applications", response_model=ApplicationResponse, status_code=status.HTTP_201_CREATED)
+@router.post("/applications", response_model=ApplicationResponse, status_code=status.HTTP_201_CREATED)
 @limiter.limit("30/minute")
-def create_application(request: Request, application: ApplicationCreate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def create_application(request: Request, application: ApplicationCreate, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     new_app = JobApplication(
         user_id=current_user.id, # this links to the logged in user
         company=application.company,
@@ -131,150 +247,601 @@ def create_application(request: Request, application: ApplicationCreate, current
     )
 
     db.add(new_app)
-    db.commit()
-    db.refresh(new_app)
+    # flush fills in the defaults the stats need, the counters commit together with the row
+    try:
+        await db.flush()
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_JOB_URL)
+    delta = StatsDelta()
+    delta.add(new_app.status, new_app.created_at)
+    await apply_stats(db, current_user.id, delta)
+    await db.commit()
+    await db.refresh(new_app)
     return new_app
 
-# get all applications
-@app.get("/applications", response_model=ApplicationListResponse)
-def get_applications(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    applications = db.query(JobApplication).filter(JobApplication.user_id == current_user.id).all()
-    return {"count": len(applications), "applications": applications}
+# rows validated and inserted per transaction during a bulk import
+BULK_CHUNK_SIZE = 500
+# cap on rejected rows listed in the report, the failed count is always exact
+MAX_REPORTED_ERRORS = 1000
+
+async def _import_chunk(db: AsyncSession, user_id: int, chunk: list, report: dict) -> None:
+    valid_rows = []
+    failed = []
+    for row_number, row in chunk:
+        try:
+            application = ApplicationCreate.model_validate(row)
+        except ValidationError as e:
+            errors = [f"{'.'.join(str(part) for part in error['loc']) or 'row'}: {error['msg']}" for error in e.errors()]
+            failed.append({"row": row_number, "errors": errors})
+            continue
+        valid_rows.append((row_number, {**application.model_dump(), "user_id": user_id}))
+
+    if valid_rows:
+        created_at = datetime.now()
+        for _, values in valid_rows:
+            values["created_at"] = values["updated_at"] = created_at
+
+        # one multi row INSERT and one commit for the whole chunk, stats included
+        # rows whose job_url the user already tracks, in the database or earlier in the upload, are skipped by the insert
+        stmt = (
+            UPSERT_INSERTS[db.get_bind().dialect.name](JobApplication)
+            .on_conflict_do_nothing(index_elements=["user_id", "job_url"])
+            .returning(JobApplication.job_url)
+        )
+        try:
+            inserted_urls = Counter((await db.scalars(stmt, [values for _, values in valid_rows])).all())
+            delta = StatsDelta()
+            duplicates = []
+            for row_number, values in valid_rows:
+                url = values["job_url"]
+                if url is not None:
+                    if not inserted_urls[url]:
+                        duplicates.append({"row": row_number, "errors": [f"job_url: {DUPLICATE_JOB_URL}"]})
+                        continue
+                    inserted_urls[url] -= 1
+                delta.add(values["status"], created_at)
+            await apply_stats(db, user_id, delta)
+            await db.commit()
+            report["created"] += len(valid_rows) - len(duplicates)
+            failed.extend(duplicates)
+        except SQLAlchemyError:
+            await db.rollback()
+            failed.extend({"row": row_number, "errors": ["row could not be saved"]} for row_number, _ in valid_rows)
+
+    report["failed"] += len(failed)
+    room = MAX_REPORTED_ERRORS - len(report["errors"])
+    report["errors"].extend(failed[:max(room, 0)])
+
+# parses the next chunk of upload rows, runs on a worker thread since reading and parsing the file blocks
+# returns the rows read before a malformed one together with the parse error
+def _read_chunk(rows, row_number: int):
+    chunk = []
+    try:
+        for row in islice(rows, BULK_CHUNK_SIZE):
+            row_number += 1
+            chunk.append((row_number, row))
+    except (ValueError, csv.Error) as e:
+        return chunk, e
+    return chunk, None
+
+# import many applications at once from an uploaded JSON array or CSV file
+# rows are parsed as they are read and bad rows are reported instead of failing the whole upload
+@router.post("/applications/bulk", response_model=BulkImportResponse)
+@limiter.limit("5/minute")
+async def bulk_import_applications(
+    request: Request,
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(json|csv)$"),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    if format is None:
+        is_csv = file.content_type == "text/csv" or (file.filename or "").lower().endswith(".csv")
+        format = "csv" if is_csv else "json"
+    rows = iter_csv_rows(file.file) if format == "csv" else iter_json_array(file.file)
+
+    report = {"created": 0, "failed": 0, "errors": []}
+    row_number = 0
+    while True:
+        chunk, error = await run_in_threadpool(_read_chunk, rows, row_number)
+        if chunk:
+            row_number = chunk[-1][0]
+            await _import_chunk(db, current_user.id, chunk, report)
+        if error is not None:
+            # a malformed upload stops the import, rows before it are still saved
+            report["failed"] += 1
+            report["errors"].append({"row": row_number + 1, "errors": [str(error)]})
+            break
+        if len(chunk) < BULK_CHUNK_SIZE:
+            break
+
+    return report
+
+# create, update and delete many applications in one request and one transaction
+# consecutive creates go in as one multi row INSERT, each update or delete is one statement however many ids it names
+# if any operation fails, for example an id that isn't yours, nothing is applied
+@router.post("/applications/batch", response_model=BatchResponse)
+@limiter.limit("30/minute")
+async def batch_applications(request: Request, batch: BatchRequest, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    delta = StatsDelta()
+    results = []
+    try:
+        for is_create, group in groupby(enumerate(batch.operations), key=lambda item: item[1].op == "create"):
+            if is_create:
+                rows = [{**operation.application.model_dump(), "user_id": current_user.id} for _, operation in group]
+                created = await db.execute(
+                    insert(JobApplication).returning(
+                        JobApplication.id, JobApplication.status, JobApplication.created_at, sort_by_parameter_order=True
+                    ),
+                    rows
+                )
+                for row in created:
+                    delta.add(row.status, row.created_at)
+                    results.append(BatchResult(op="create", ids=[row.id]))
+                continue
+
+            for index, operation in group:
+                ids = sorted(set(operation.ids))
+                if operation.op == "update":
+                    values = operation.changes.model_dump(exclude_none=True)
+                    if not values:
+                        raise HTTPException(status_code=400, detail=f"Operation {index} has no changes")
+                    updated = await _update_applications(db, current_user.id, ids, values)
+                    for app, old_status in updated:
+                        delta.move(old_status, app.status)
+                    done = [app.id for app, _ in updated]
+                else:
+                    deleted = await _delete_applications(db, current_user.id, ids)
+                    for row in deleted:
+                        delta.remove(row.status, row.created_at)
+                    done = [row.id for row in deleted]
+
+                missing = sorted(set(ids) - set(done))
+                if missing:
+                    # the session rolls the whole batch back when it closes
+                    raise HTTPException(status_code=404, detail=f"Operation {index}: applications not found: {missing}")
+                results.append(BatchResult(op=operation.op, ids=sorted(done)))
+    except IntegrityError:
+        # a create or an update reused a job_url the user already tracks
+        raise HTTPException(status_code=409, detail=DUPLICATE_JOB_URL)
+
+    await apply_stats(db, current_user.id, delta)
+    await db.commit()
+    return BatchResponse(results=results)
+
+# fields the list endpoints can return, the unbounded text columns are only sent by the detail endpoints
+APPLICATION_LIST_FIELDS = [name for name in ApplicationResponse.model_fields if name != "notes"]
+SCRAPED_JOB_LIST_FIELDS = [name for name in ScrapedJobResponse.model_fields if name != "description"]
+FIELDS_DESCRIPTION = "Comma separated fields to return, all list fields when left out"
+
+# get applications, most recently updated first, one page at a time
+# answers 304 when nothing changed since the ETag the client sent, every write bumps updated_at or the count
+# rows go straight from the database to orjson, response_model is only there for the docs
+@router.get("/applications", response_model=ApplicationListResponse)
+async def get_applications(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    fields = parse_fields(fields, APPLICATION_LIST_FIELDS)
+    count, last_update = (await db.execute(
+        select(func.count(), func.max(JobApplication.updated_at)).where(JobApplication.user_id == current_user.id)
+    )).one()
+    etag = weak_etag("applications", current_user.id, count, last_update, cursor, limit, fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    # the sort column is selected after the requested ones for the cursor even when it isn't returned
+    stmt = select(*(getattr(JobApplication, name) for name in fields), JobApplication.updated_at).where(JobApplication.user_id == current_user.id)
+    applications, next_cursor = await paginate(db, stmt, JobApplication.updated_at, JobApplication.id, cursor, limit)
+    return ORJSONResponse(
+        {"count": len(applications), "applications": rows_to_dicts(applications, fields), "next_cursor": next_cursor},
+        headers=etag_headers(etag)
+    )
+
+# funnel numbers for the dashboard, read from the per user counters so the cost doesn't grow with the number of applications
+# registered before /applications/{app_id} like the export
+@router.get("/applications/stats", response_model=ApplicationStats)
+async def get_application_stats(
+    weeks: int = Query(12, ge=1, le=520, description="How many weeks back to count"),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
+):
+    by_status = {application_status: 0 for application_status in ApplicationStatus}
+    by_status.update((await db.execute(
+        select(ApplicationStatusCount.status, ApplicationStatusCount.count)
+        .where(ApplicationStatusCount.user_id == current_user.id)
+    )).all())
+
+    since = week_start(datetime.now()) - timedelta(weeks=weeks - 1)
+    weekly = (await db.execute(
+        select(ApplicationWeeklyCount.week_start, ApplicationWeeklyCount.count)
+        .where(
+            ApplicationWeeklyCount.user_id == current_user.id,
+            ApplicationWeeklyCount.week_start >= since,
+            ApplicationWeeklyCount.count > 0
+        )
+        .order_by(ApplicationWeeklyCount.week_start)
+    )).all()
+
+    total = sum(by_status.values())
+    past_wishlist = total - by_status[ApplicationStatus.WISHLIST]
+    offers = by_status[ApplicationStatus.OFFER] + by_status[ApplicationStatus.ACCEPTED]
+    return {
+        "total": total,
+        "by_status": by_status,
+        "weekly": [{"week_start": week, "count": count} for week, count in weekly],
+        "offer_rate": offers / past_wishlist if past_wishlist else None
+    }
+
+# columns written by the export, in csv column order
+EXPORT_COLUMNS = [
+    JobApplication.id, JobApplication.company, JobApplication.position, JobApplication.status,
+    JobApplication.job_url, JobApplication.notes, JobApplication.applied_date, JobApplication.salary_range,
+    JobApplication.created_at, JobApplication.updated_at
+]
+# rows fetched from the server side cursor per round trip
+EXPORT_BATCH_SIZE = 500
+
+def _export_value(value):
+    if isinstance(value, ApplicationStatus):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+async def _export_ndjson(result):
+    async for batch in result.partitions():
+        yield "".join(json.dumps({key: _export_value(value) for key, value in row._mapping.items()}) + "\n" for row in batch)
+
+async def _export_csv(result):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # send the header straight away so the client gets its first byte before any rows are fetched
+    writer.writerow([column.key for column in EXPORT_COLUMNS])
+    yield buffer.getvalue()
+    async for batch in result.partitions():
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_export_value(value) for value in row] for row in batch)
+        yield buffer.getvalue()
+
+# export all applications, streamed so memory stays flat no matter how many rows there are
+# this has to be registered before /applications/{app_id} or "export" gets parsed as an id
+@router.get("/applications/export")
+async def export_applications(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    # stream with yield_per reads rows from a server side cursor instead of buffering the whole result
+    stmt = (
+        select(*EXPORT_COLUMNS)
+        .where(JobApplication.user_id == current_user.id)
+        .order_by(JobApplication.id)
+        .execution_options(yield_per=EXPORT_BATCH_SIZE)
+    )
+    result = await db.stream(stmt)
+
+    if format == "csv":
+        body, media_type = _export_csv(result), "text/csv"
+    else:
+        body, media_type = _export_ndjson(result), "application/x-ndjson"
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="applications.{format}"'}
+    )
 
 # get applications by id
-@app.get("/applications/{app_id}", response_model=ApplicationResponse)
-def get_application_with_id(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    app = db.query(JobApplication).filter(JobApplication.id == app_id, JobApplication.user_id == current_user.id).first()
+@router.get("/applications/{app_id}", response_model=ApplicationResponse)
+async def get_application_with_id(request: Request, response: Response, app_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
+    # only the version column is read before deciding on a 304
+    updated_at = await db.scalar(select(JobApplication.updated_at).where(JobApplication.id == app_id, JobApplication.user_id == current_user.id))
+    if updated_at is not None:
+        etag = weak_etag("application", current_user.id, app_id, updated_at)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        set_etag(response, etag)
+
+    app = await db.scalar(select(JobApplication).where(JobApplication.id == app_id, JobApplication.user_id == current_user.id))
     if not app:
         raise HTTPException(status_code=404, detail="Application not found")
     return app
 
-# update an application
-@app.put("/applications/{app_id}", response_model=ApplicationResponse)
-def update_application(app_id: int, application_update: ApplicationUpdate, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    app = db.query(JobApplication).filter(JobApplication.id == app_id, JobApplication.user_id == current_user.id).first()
-    if not app:
+# updates the user's applications in ids with one UPDATE ... RETURNING, returns (application, status before) pairs
+# moving the stats counters needs the old status: postgres reads it from a locked snapshot of the same rows joined
+# into the UPDATE, other databases can't return joined columns so they read it under the lock first
+async def _update_applications(db: AsyncSession, user_id: int, ids: list, values: dict) -> list:
+    owned = and_(JobApplication.user_id == user_id, JobApplication.id.in_(ids))
+    stmt = (
+        update(JobApplication)
+        .values(values)
+        .execution_options(synchronize_session=False, populate_existing=True)
+    )
+    if "status" not in values:
+        updated = await db.scalars(stmt.where(owned).returning(JobApplication))
+        return [(app, app.status) for app in updated]
+    if db.get_bind().dialect.name == "postgresql":
+        before = select(JobApplication.id, JobApplication.status).where(owned).with_for_update().subquery("before")
+        updated = await db.execute(stmt.where(JobApplication.id == before.c.id).returning(JobApplication, before.c.status))
+        return [tuple(row) for row in updated]
+    old_statuses = dict((await db.execute(select(JobApplication.id, JobApplication.status).where(owned).with_for_update())).all())
+    updated = await db.scalars(stmt.where(owned).returning(JobApplication))
+    return [(app, old_statuses[app.id]) for app in updated]
+
+# deletes the user's applications in ids with one DELETE ... RETURNING, the returned rows carry what the stats need
+async def _delete_applications(db: AsyncSession, user_id: int, ids: list) -> list:
+    deleted = await db.execute(
+        delete(JobApplication)
+        .where(JobApplication.user_id == user_id, JobApplication.id.in_(ids))
+        .returning(JobApplication.id, JobApplication.status, JobApplication.created_at)
+    )
+    return deleted.all()
+
+# update an application, one UPDATE ... RETURNING instead of a select, an update and a refresh
+@router.put("/applications/{app_id}", response_model=ApplicationResponse)
+async def update_application(app_id: int, application_update: ApplicationUpdate, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    values = application_update.model_dump(exclude_none=True)
+    if not values:
+        app = await db.scalar(select(JobApplication).where(JobApplication.id == app_id, JobApplication.user_id == current_user.id))
+        if not app:
+            raise HTTPException(status_code=404, detail="Application not found")
+        return app
+
+    try:
+        updated = await _update_applications(db, current_user.id, [app_id], values)
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail=DUPLICATE_JOB_URL)
+    if not updated:
         raise HTTPException(status_code=404, detail="Application not found")
-    
-    if application_update.company is not None:
-        app.company = application_update.company
-    if application_update.position is not None:
-        app.position = application_update.position
-    if application_update.status is not None:
-        app.status = application_update.status
-    if application_update.job_url is not None:
-        app.job_url = application_update.job_url
-    if application_update.notes is not None:
-        app.notes = application_update.notes
-    if application_update.applied_date is not None:
-        app.applied_date = application_update.applied_date
-    if application_update.salary_range is not None:
-        app.salary_range = application_update.salary_range
-
-    db.commit()
-    db.refresh(app)
+    app, old_status = updated[0]
+
+    delta = StatsDelta()
+    delta.move(old_status, app.status)
+    await apply_stats(db, current_user.id, delta)
+    await db.commit()
     return app
 
 # delete an application
-@app.delete("/applications/{app_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_application(app_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    app = db.query(JobApplication).filter(JobApplication.id == app_id, JobApplication.user_id == current_user.id).first()
-    if not app:
+@router.delete("/applications/{app_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_application(app_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    deleted = await _delete_applications(db, current_user.id, [app_id])
+    if not deleted:
         raise HTTPException(status_code=404, detail="Application not found")
-    
-    db.delete(app)
-    db.commit()
+
+    delta = StatsDelta()
+    delta.remove(deleted[0].status, deleted[0].created_at)
+    await apply_stats(db, current_user.id, delta)
+    await db.commit()
     return None
 
 # get info about the currently logged in user
-@app.get("/me", response_model=UserResponse)
-def get_current_user_info(current_user: User = Depends(get_current_user)):
+@router.get("/me", response_model=UserResponse)
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     return current_user
 
 # SCRAPING
-@app.post("/scrape/jobs", response_model=ScrapedJobListResponse)
+
+# most results one scrape may ask for, each source fetches its pages for them concurrently
+MAX_SCRAPE_RESULTS = 100
+
+# queue a scrape, the worker pool runs it and GET /scrape/jobs/{task_id} reports how it went
+@router.post("/scrape/jobs", response_model=ScrapeTaskResponse, status_code=status.HTTP_202_ACCEPTED)
 @limiter.limit("10/hour")
-def scrape_jobs(
+async def scrape_jobs(
     request: Request,
     query: str = "software engineer intern", 
-    location: str = "", max_results: int = 10, 
+    location: str = "", max_results: int = Query(10, ge=1, le=MAX_SCRAPE_RESULTS),
     use_mock: bool = True, 
-    current_user: Session = Depends(get_current_user), 
-    db: Session = Depends(get_db)):
-
-    # choose scraper
-    scraper = MockScraper() if use_mock else IndeedScraper()
-
-    scraped_jobs = scraper.search_jobs(query, location, max_results)
-    saved_jobs = []
-    duplicates = 0
-
-    for job_data in scraped_jobs:
-        # check if jobs exists already using url
-        existing = db.query(ScrapedJob).filter(ScrapedJob.url == job_data["url"]).first()
-        if existing:
-            duplicates += 1
-            continue
-        
-        # create new scraped job
-        new_job = ScrapedJob(
-            title=job_data["title"],
-            company=job_data["company"],
-            location=job_data.get("location"),
-            url=job_data["url"],
-            description=job_data.get("description"),
-            source=job_data["source"]
-        )
-        db.add(new_job)
-        saved_jobs.append(new_job)
-    db.commit()
-
-    # refresh saved jobs to get id's
-    for job in saved_jobs:
-        db.refresh(job)
-    
-    return {
-        "count": len(saved_jobs),
-        "jobs": saved_jobs
-    }
+    sources: Optional[List[str]] = Query(None),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)):
+
+    # choose scrapers, naming several sources fans the query out to all of them at once
+    if sources:
+        # imported here so the scraping stack stays out of the api's startup
+        from scraper import SOURCES
+        unknown = [name for name in sources if name not in SOURCES]
+        if unknown:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Unknown scrape source: {', '.join(unknown)}")
+        sources = sorted(set(sources))
+    else:
+        sources = ["mock" if use_mock else "indeed"]
+
+    dedupe_key = task_dedupe_key(current_user.id, query, location, max_results, sources)
+    active = [ScrapeTaskStatus.PENDING, ScrapeTaskStatus.RUNNING]
+
+    # the same request already waiting in the queue is returned instead of scraping twice
+    active_task = select(ScrapeTask).where(ScrapeTask.dedupe_key == dedupe_key, ScrapeTask.status.in_(active))
+    existing = await db.scalar(active_task)
+    if existing:
+        return existing
+
+    task = ScrapeTask(
+        user_id=current_user.id,
+        query=query,
+        location=location,
+        max_results=max_results,
+        sources=sources,
+        dedupe_key=dedupe_key
+    )
+    db.add(task)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # lost a race with an identical request, the unique index kept just one
+        await db.rollback()
+        return (await db.scalars(active_task)).one()
+    await db.refresh(task)
+    return task
+
+# check on a queued scrape
+@router.get("/scrape/jobs/{task_id}", response_model=ScrapeTaskResponse)
+async def get_scrape_task(task_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    task = await db.scalar(select(ScrapeTask).where(ScrapeTask.id == task_id, ScrapeTask.user_id == current_user.id))
+    if not task:
+        raise HTTPException(status_code=404, detail="Scrape task not found")
+    return task
 
 # get scraped jobs from database
-@app.get("/scraped-jobs/", response_model=ScrapedJobListResponse)
-def get_scraped_jobs(
-    skip: int = 0,
-    limit: int = 50,
+@router.get("/scraped-jobs/", response_model=ScrapedJobListResponse)
+async def get_scraped_jobs(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
     source: Optional[str] = None,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    collapse: bool = Query(False, description="Hide reposts, only the first posting of each job is listed"),
+    cluster_id: Optional[int] = Query(None, description="List every posting of one job"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_read_db)
 ):
-    
-    query = db.query(ScrapedJob)
+    fields = parse_fields(fields, SCRAPED_JOB_LIST_FIELDS)
 
+    filters = []
     if source:
-        query = query.filter(ScrapedJob.source == source)
-    
-    jobs = query.order_by(ScrapedJob.scraped_at.desc()).offset(skip).limit(limit).all()
-    return {"count": len(jobs), "jobs": jobs}
+        filters.append(ScrapedJob.source == source)
+    if collapse:
+        filters.append(ScrapedJob.cluster_id.is_(None))
+    if cluster_id is not None:
+        filters.append(or_(ScrapedJob.id == cluster_id, ScrapedJob.cluster_id == cluster_id))
+
+    # new jobs raise the newest id, purges and cluster reassignments bump the version
+    # both are single row lookups, so a 304 costs the same however many jobs there are
+    version, last_id = (await db.execute(select(
+        select(DataVersion.version).where(DataVersion.name == SCRAPED_JOBS_VERSION).scalar_subquery(),
+        select(func.max(ScrapedJob.id)).scalar_subquery(),
+    ))).one()
+    etag = weak_etag("scraped-jobs", version, last_id, source, collapse, cluster_id, cursor, limit, fields)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    stmt = select(*(getattr(ScrapedJob, name) for name in fields), ScrapedJob.scraped_at).where(*filters)
+    jobs, next_cursor = await paginate(db, stmt, ScrapedJob.scraped_at, ScrapedJob.id, cursor, limit)
+    return ORJSONResponse(
+        {"count": len(jobs), "jobs": rows_to_dicts(jobs, fields), "next_cursor": next_cursor},
+        headers=etag_headers(etag)
+    )
 
-# convert scraped job into application tracker
-@app.post("/scraped-jobs/{job_id}/convert")
-def convert_to_application(job_id: int, current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    scraped_job = db.query(ScrapedJob).filter(ScrapedJob.id == job_id).first()
+# full text search over scraped job titles, companies and descriptions, best match first
+@router.get("/scraped-jobs/search", response_model=ScrapedJobListResponse)
+async def search_scraped_jobs_endpoint(
+    q: str = Query(..., min_length=1, max_length=200),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    collapse: bool = Query(False, description="Hide reposts, only the first posting of each job is listed"),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    fields = parse_fields(fields, SCRAPED_JOB_LIST_FIELDS)
+    jobs, next_cursor = await search_scraped_jobs(db, q, cursor, limit, fields, collapse)
+    return ORJSONResponse({"count": len(jobs), "jobs": jobs, "next_cursor": next_cursor})
+
+# get one scraped job, registered after /scraped-jobs/search so "search" isn't parsed as an id
+@router.get("/scraped-jobs/{job_id}", response_model=ScrapedJobResponse)
+async def get_scraped_job(request: Request, response: Response, job_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_read_db)):
+    version = (await db.execute(select(ScrapedJob.scraped_at, ScrapedJob.cluster_id).where(ScrapedJob.id == job_id))).first()
+    if version is None:
+        raise HTTPException(status_code=404, detail="Scraped job not found")
 
-    if not scraped_job:
+    etag = weak_etag("scraped-job", job_id, *version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+
+    job = await db.get(ScrapedJob, job_id)
+    if not job:
         raise HTTPException(status_code=404, detail="Scraped job not found")
-    
-    # create application from scraped job
-    new_app = JobApplication(
-        user_id=current_user.id,
-        company=scraped_job.company,
-        position=scraped_job.title,
-        status=ApplicationStatus.WISHLIST,
-        job_url=scraped_job.url,
-        notes=f"Found via scraping from {scraped_job.source}"
+    return job
+
+# convert scraped job into application tracker
+# creates a wishlist application for each scraped job in one INSERT ... SELECT, jobs whose url the user already
+# tracks are skipped by the unique (user_id, job_url) index instead of being looked up first
+# returns job id -> application id for the created applications and for the ones that already existed
+async def _convert_scraped_jobs(db: AsyncSession, user_id: int, job_ids: list) -> tuple:
+    now = datetime.now()
+    columns = select(
+        literal(user_id),
+        ScrapedJob.company,
+        ScrapedJob.title,
+        # postgres can't infer an enum from a bare parameter in a select list
+        cast(ApplicationStatus.WISHLIST, JobApplication.status.type),
+        ScrapedJob.url,
+        literal("Found via scraping from ") + ScrapedJob.source,
+        literal(now),
+        literal(now),
+    ).where(ScrapedJob.id.in_(job_ids))
+    stmt = (
+        UPSERT_INSERTS[db.get_bind().dialect.name](JobApplication)
+        .from_select(["user_id", "company", "position", "status", "job_url", "notes", "created_at", "updated_at"], columns)
+        .on_conflict_do_nothing(index_elements=["user_id", "job_url"])
+        .returning(JobApplication.id)
     )
+    created_ids = set((await db.scalars(stmt)).all())
 
-    db.add(new_app)
-    db.commit()
-    db.refresh(new_app)
-    return{"message": "Converted to application!", "application_id": new_app.id}
\ No newline at end of file
+    # scraped job urls are unique, so the url ties each requested job to the user's application for it
+    tracked = await db.execute(
+        select(ScrapedJob.id, JobApplication.id)
+        .join(JobApplication, and_(JobApplication.user_id == user_id, JobApplication.job_url == ScrapedJob.url))
+        .where(ScrapedJob.id.in_(job_ids))
+    )
+    created, existing = {}, {}
+    for job_id, application_id in tracked:
+        (created if application_id in created_ids else existing)[job_id] = application_id
+
+    delta = StatsDelta()
+    for _ in created:
+        delta.add(ApplicationStatus.WISHLIST, now)
+    await apply_stats(db, user_id, delta)
+    await db.commit()
+    return created, existing
+
+# turn scraped jobs into wishlist applications, converting a job twice returns the application it already has
+@router.post("/scraped-jobs/convert", response_model=ConvertResponse)
+async def convert_scraped_jobs(body: ConvertRequest, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    job_ids = sorted(set(body.job_ids))
+    created, existing = await _convert_scraped_jobs(db, current_user.id, job_ids)
+    return ConvertResponse(
+        created=[ConvertedJob(job_id=job_id, application_id=created[job_id]) for job_id in job_ids if job_id in created],
+        existing=[ConvertedJob(job_id=job_id, application_id=existing[job_id]) for job_id in job_ids if job_id in existing],
+        not_found=[job_id for job_id in job_ids if job_id not in created and job_id not in existing],
+    )
+
+@router.post("/scraped-jobs/{job_id}/convert")
+async def convert_to_application(job_id: int, current_user: Principal = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    created, existing = await _convert_scraped_jobs(db, current_user.id, [job_id])
+    if job_id in created:
+        return {"message": "Converted to application!", "application_id": created[job_id]}
+    if job_id in existing:
+        return {"message": "Already in your applications", "application_id": existing[job_id]}
+    raise HTTPException(status_code=404, detail="Scraped job not found")
+
+
+# builds the api, importing this module or calling this opens no database connection
+def create_app() -> FastAPI:
+    # orjson encodes responses in C, several times faster than the stdlib json encoder
+    app = FastAPI(title="Job Application Tracker API", lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    app.add_exception_handler(PasswordHasherBusy, password_hasher_busy_handler)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(track_recent_writers)
+    app.middleware("http")(record_metrics)
+    app.include_router(router)
+    return app
+
+
+app = create_app()
@@ -0,0 +1,210 @@
+import bisect
+import collections
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional, Sequence
+
+# process wide metrics, served by GET /metrics in the prometheus text exposition format
+# kept in memory per process, every api process is scraped on its own
+
+# adds a Server-Timing header with the request's db and total time, shows up in browser dev tools
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() in ("1", "true", "yes")
+# when set GET /metrics needs "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+SCRAPE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(names, values)} {_format_value(value)}")
+        return lines
+
+    def samples(self):
+        return []
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [("", self.labels, key, value) for key, value in values]
+
+
+# cumulative buckets as prometheus expects, observations are counted in the first bucket they fit
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value: float, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((key, (list(counts), total)) for key, (counts, total) in self._series.items())
+        samples = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", self.labels + ("le",), key + (_format_value(float(bound)),), cumulative))
+            samples.append(("_sum", self.labels, key, total))
+            samples.append(("_count", self.labels, key, cumulative))
+        return samples
+
+
+# read when scraped, for values something else already keeps (pool sizes, cache counters)
+class CallbackMetric(Metric):
+    def __init__(self, name: str, documentation: str, labels: Sequence[str], read: Callable[[], dict], kind: str = "gauge"):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self.read = read
+
+    def samples(self):
+        return [("", self.labels, key, value) for key, value in sorted(self.read().items())]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    "http_requests_total", "Requests handled, by route and status code.", ("method", "route", "status")))
+http_latency = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to the response start, by route.", ("method", "route")))
+http_db_queries = registry.register(Histogram(
+    "http_request_db_queries", "SQL statements run by one request.", ("method", "route"), QUERY_COUNT_BUCKETS))
+http_db_time = registry.register(Histogram(
+    "http_request_db_seconds", "Time one request spent waiting on SQL statements.", ("method", "route"), DB_BUCKETS))
+db_queries = registry.register(Counter(
+    "db_queries_total", "SQL statements run, by engine.", ("engine",)))
+db_query_time = registry.register(Histogram(
+    "db_query_duration_seconds", "Duration of single SQL statements, by engine.", ("engine",), DB_BUCKETS))
+db_pool_wait = registry.register(Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection, by engine.", ("engine",), DB_BUCKETS))
+scrape_fetch_time = registry.register(Histogram(
+    "scrape_fetch_duration_seconds", "Duration of scraper HTTP fetches, by host and outcome.", ("host", "outcome"), SCRAPE_BUCKETS))
+scrape_parse_time = registry.register(Histogram(
+    "scrape_parse_duration_seconds", "Time to parse one fetched result page, by source.", ("source",), DB_BUCKETS + (2.5, 5.0)))
+scrape_task_time = registry.register(Histogram(
+    "scrape_task_duration_seconds", "Duration of scrape task attempts, by final status.", ("status",), SCRAPE_BUCKETS))
+
+
+# SQL statements and their time within one request, filled by the engine hooks in database.py
+class RequestDBStats:
+    __slots__ = ("queries", "seconds", "scope", "shapes")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.queries = 0
+        self.seconds = 0.0
+        # the asgi scope, routing adds the matched route to it while the request runs
+        self.scope = scope
+        # statement shape -> times run, only counted while query diagnostics are on
+        self.shapes = collections.Counter()
+
+
+# the route template, not the raw path, so ids don't create a series each
+def route_label(scope: dict) -> str:
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
+
+
+current_request_db: ContextVar[Optional[RequestDBStats]] = ContextVar("current_request_db", default=None)
+
+
+def record_query(engine_name: str, seconds: float):
+    db_queries.inc(engine_name)
+    db_query_time.observe(seconds, engine_name)
+    stats = current_request_db.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+
+
+def record_request(method: str, route: str, status_code: int, seconds: float, db_stats: RequestDBStats):
+    http_requests.inc(method, route, str(status_code))
+    http_latency.observe(seconds, method, route)
+    http_db_queries.observe(db_stats.queries, method, route)
+    http_db_time.observe(db_stats.seconds, method, route)
+
+
+def server_timing(seconds: float, db_stats: RequestDBStats) -> str:
+    return f'db;dur={db_stats.seconds * 1000:.1f};desc="{db_stats.queries} queries", app;dur={seconds * 1000:.1f}'
+
+
+# times a block into a histogram, e.g. with timed(scrape_parse_time, "indeed"):
+class timed:
+    def __init__(self, histogram: Histogram, *label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
@@ -0,0 +1,93 @@
+import asyncio
+from concurrent.futures import Future, ProcessPoolExecutor
+from passlib.context import CryptContext
+from typing import Optional, Tuple
+import multiprocessing
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# bcrypt cost, raising it only affects new hashes, old ones are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# processes doing bcrypt work, 0 hashes inline on the calling thread
+HASH_POOL_SIZE = int(os.getenv("HASH_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+# hashes queued or running before new ones are turned away
+HASH_QUEUE_DEPTH = int(os.getenv("HASH_QUEUE_DEPTH", str(max(HASH_POOL_SIZE, 1) * 8)))
+
+# password hashing
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_QUEUE_DEPTH)
+
+
+# raised instead of queueing when the hashing pool is saturated
+class PasswordHasherBusy(Exception):
+    pass
+
+
+# these run inside the pool processes
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, forking a process that is already running threads can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=HASH_POOL_SIZE, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _submit(fn, *args) -> Future:
+    if not _slots.acquire(blocking=False):
+        raise PasswordHasherBusy()
+    try:
+        if HASH_POOL_SIZE > 0:
+            future = _get_pool().submit(fn, *args)
+        else:
+            future = Future()
+            future.set_result(fn(*args))
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    return future
+
+
+# returns whether the password matches, plus a new hash when the stored one uses outdated settings
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return _submit(_verify_and_update, plain_password, hashed_password).result()
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+def get_password_hash(password: str) -> str:
+    return _submit(_hash, password).result()
+
+
+# awaitable versions for async endpoints, the event loop keeps serving requests while bcrypt runs
+async def _run(fn, *args):
+    if HASH_POOL_SIZE > 0:
+        return await asyncio.wrap_future(_submit(fn, *args))
+    return await asyncio.to_thread(lambda: _submit(fn, *args).result())
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run(_verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run(_hash, password)
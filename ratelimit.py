@@ -0,0 +1,92 @@
+import os
+import sqlite3
+import threading
+import time
+from limits.storage import Storage
+from sqlalchemy.engine import make_url
+
+# where the rate limit counters live, shared by every api worker unless it is memory://
+# memory://                                  per process, the default, limits are per worker and reset on restart
+# sqlite:////var/lib/job-tracker/limits.db   one host, every worker process shares the file (put it on /dev/shm to keep it in memory)
+# redis://localhost:6379/0                   several hosts, needs the redis package
+RATELIMIT_STORAGE_URL = os.getenv("RATELIMIT_STORAGE_URL", "memory://")
+
+# expired counters are deleted every this many hits per process
+CLEANUP_INTERVAL = 1000
+
+_INCR = """
+INSERT INTO rate_limits (key, count, expires_at) VALUES (?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    count = CASE WHEN rate_limits.expires_at <= ? THEN excluded.count ELSE rate_limits.count + excluded.count END,
+    expires_at = CASE WHEN rate_limits.expires_at <= ? THEN excluded.expires_at ELSE rate_limits.expires_at END
+RETURNING count
+"""
+
+
+# fixed window counters in a sqlite file, registered with limits for sqlite:// storage urls
+# every hit is one upsert, sqlite serializes them so concurrent workers never lose a count
+class SQLiteStorage(Storage):
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = make_url(uri).database
+        if not self.path or self.path == ":memory:":
+            raise ValueError("The sqlite rate limit storage needs a file, use memory:// for per process limits")
+        self.timeout = float(options.get("timeout", 5))
+        # sqlite connections can't be shared between threads
+        self._local = threading.local()
+        self._hits = 0
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # opened on first use, the limiter is built when main.py is imported and that must not touch the disk
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # autocommit, each statement is its own transaction
+            connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            # readers don't block the writer, and a hit doesn't wait for an fsync
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS rate_limits (key TEXT PRIMARY KEY, count INTEGER NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.connection = connection
+        return connection
+
+    def incr(self, key: str, expiry: int, amount: int = 1) -> int:
+        now = time.time()
+        count = self._connection().execute(_INCR, (key, amount, now + expiry, now, now)).fetchone()[0]
+        self._hits += 1
+        if self._hits % CLEANUP_INTERVAL == 0:
+            self._connection().execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        return count
+
+    def get(self, key: str) -> int:
+        row = self._connection().execute(
+            "SELECT count FROM rate_limits WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row[0] if row else 0
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT expires_at FROM rate_limits WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return row[0] if row else now
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> int:
+        return self._connection().execute("DELETE FROM rate_limits").rowcount
+
+    def clear(self, key: str) -> None:
+        self._connection().execute("DELETE FROM rate_limits WHERE key = ?", (key,))
@@ -0,0 +1,204 @@
+import argparse
+import gzip
+import os
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+import orjson
+from sqlalchemy import delete, exists, func, select, tuple_, update
+from sqlalchemy.orm import Session, aliased
+from database import RefreshToken, ScrapedJob, ScrapedJobBucket, SCRAPED_JOBS_VERSION, bump_data_version
+
+# keeps scraped_jobs and refresh_tokens from growing forever, run from cron: python retention.py [--dry-run]
+# jobs older than SCRAPED_JOB_RETENTION_DAYS are purged, then each source keeps its SCRAPED_JOBS_PER_SOURCE newest, 0 turns a rule off
+# every purged job is appended to a compressed archive file before it is deleted
+SCRAPED_JOB_RETENTION_DAYS = int(os.getenv("SCRAPED_JOB_RETENTION_DAYS", "180"))
+SCRAPED_JOBS_PER_SOURCE = int(os.getenv("SCRAPED_JOBS_PER_SOURCE", "0"))
+# jobs deleted per transaction, small batches keep every lock short so scrapes and the api never wait long
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+# one append only NDJSON file per month of scraped_at, e.g. archive/scraped_jobs-2026-04.ndjson.zst
+ARCHIVE_DIR = os.getenv("SCRAPED_JOB_ARCHIVE_DIR", "archive")
+# zstd or gzip, each batch is appended as a frame of its own and the tools read the frames back as one stream
+ARCHIVE_COMPRESSION = os.getenv("SCRAPED_JOB_ARCHIVE_COMPRESSION", "zstd")
+
+# everything but the minhash, which dedup.py can recompute from the text
+ARCHIVE_COLUMNS = [
+    ScrapedJob.id, ScrapedJob.title, ScrapedJob.company, ScrapedJob.location, ScrapedJob.url, ScrapedJob.description,
+    ScrapedJob.posted_date, ScrapedJob.source, ScrapedJob.scraped_at, ScrapedJob.cluster_id,
+]
+ARCHIVE_EXTENSIONS = {"zstd": ".zst", "gzip": ".gz"}
+
+
+def _compressor(compression: str):
+    if compression == "gzip":
+        return gzip.compress
+    if compression == "zstd":
+        # only loaded when archiving, the api never needs it
+        import zstandard
+        return zstandard.ZstdCompressor(level=10).compress
+    raise ValueError(f"Unknown archive compression {compression}, use zstd or gzip")
+
+
+class Archive:
+    def __init__(self, directory: str = ARCHIVE_DIR, compression: str = ARCHIVE_COMPRESSION):
+        # fails before anything is deleted when the compression is unknown or its package is missing
+        self.compress = _compressor(compression)
+        self.extension = ARCHIVE_EXTENSIONS[compression]
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    # synced to disk before the caller deletes the rows, a crash in between archives them twice rather than never
+    def write(self, rows):
+        by_month = defaultdict(list)
+        for row in rows:
+            month = row.scraped_at.strftime("%Y-%m") if row.scraped_at else "undated"
+            by_month[month].append(orjson.dumps(row._asdict()) + b"\n")
+        for month, lines in by_month.items():
+            with open(os.path.join(self.directory, f"scraped_jobs-{month}.ndjson{self.extension}"), "ab") as archive_file:
+                archive_file.write(self.compress(b"".join(lines)))
+                archive_file.flush()
+                os.fsync(archive_file.fileno())
+
+
+# reposts point at the first posting of their cluster, when that one is purged the oldest surviving repost takes its place
+def _promote_reposts(db: Session, purged_ids: list):
+    survivors = db.execute(
+        select(ScrapedJob.id, ScrapedJob.cluster_id)
+        .where(ScrapedJob.cluster_id.in_(purged_ids), ScrapedJob.id.not_in(purged_ids))
+        .order_by(ScrapedJob.cluster_id, ScrapedJob.id)
+    ).all()
+    first_posting = {}
+    changes = []
+    for job_id, cluster_id in survivors:
+        first = first_posting.setdefault(cluster_id, job_id)
+        changes.append({"id": job_id, "cluster_id": None if first == job_id else first})
+    if changes:
+        db.execute(update(ScrapedJob), changes)
+
+
+# deletes the jobs matching condition oldest first, one committed batch at a time
+def _purge(db: Session, condition, archive: Optional[Archive], batch_size: int, pause: float) -> int:
+    purged = 0
+    while True:
+        rows = db.execute(
+            select(*ARCHIVE_COLUMNS).where(condition).order_by(ScrapedJob.scraped_at, ScrapedJob.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return purged
+
+        ids = [row.id for row in rows]
+        if archive is not None:
+            archive.write(rows)
+        _promote_reposts(db, ids)
+        # sqlite doesn't enforce the cascade unless foreign keys are switched on
+        db.execute(delete(ScrapedJobBucket).where(ScrapedJobBucket.job_id.in_(ids)))
+        db.execute(delete(ScrapedJob).where(ScrapedJob.id.in_(ids)))
+        # GET /scraped-jobs/ ETags change even when the newest job stays
+        bump_data_version(db, SCRAPED_JOBS_VERSION)
+        db.commit()
+        purged += len(ids)
+        if pause:
+            time.sleep(pause)
+
+
+# the retention rules as conditions on scraped_jobs, each one walks an index in scraped_at order
+def retention_conditions(db: Session, max_age_days: int, per_source: int, now: Optional[datetime] = None) -> dict:
+    conditions = {}
+    if max_age_days > 0:
+        conditions["age"] = ScrapedJob.scraped_at < (now or datetime.now()) - timedelta(days=max_age_days)
+    if per_source > 0:
+        for source in db.scalars(select(ScrapedJob.source).distinct()).all():
+            # the oldest job the source keeps, everything older goes
+            oldest_kept = db.execute(
+                select(ScrapedJob.scraped_at, ScrapedJob.id)
+                .where(ScrapedJob.source == source)
+                .order_by(ScrapedJob.scraped_at.desc(), ScrapedJob.id.desc())
+                .offset(per_source - 1)
+                .limit(1)
+            ).first()
+            if oldest_kept is not None:
+                conditions[f"source {source}"] = (ScrapedJob.source == source) & (
+                    tuple_(ScrapedJob.scraped_at, ScrapedJob.id) < tuple_(*oldest_kept)
+                )
+    return conditions
+
+
+# returns jobs purged per rule, with dry_run only counts them
+# the per source caps are worked out after the age rule ran so they count what is left
+def enforce_retention(
+    db: Session,
+    max_age_days: int = SCRAPED_JOB_RETENTION_DAYS,
+    per_source: int = SCRAPED_JOBS_PER_SOURCE,
+    archive: Optional[Archive] = None,
+    batch_size: int = RETENTION_BATCH_SIZE,
+    pause: float = 0,
+    dry_run: bool = False,
+) -> dict:
+    purged = {}
+    aged = None
+    for rules in ({"max_age_days": max_age_days, "per_source": 0}, {"max_age_days": 0, "per_source": per_source}):
+        for rule, condition in retention_conditions(db, **rules).items():
+            if not dry_run:
+                purged[rule] = _purge(db, condition, archive, batch_size, pause)
+                continue
+            # nothing was deleted, jobs the age rule already counted aren't counted again
+            if aged is not None and rule != "age":
+                condition = condition & ~aged
+            purged[rule] = db.scalar(select(func.count()).select_from(ScrapedJob).where(condition))
+            if rule == "age":
+                aged = condition
+    return purged
+
+
+# refresh tokens nobody can use any more, past their expiry or in a family with no live token left
+# rotated tokens of a live family stay until they expire, using one again revokes the whole family
+def stale_refresh_tokens(now: Optional[datetime] = None):
+    live = aliased(RefreshToken)
+    live_family = exists().where(live.family_id == RefreshToken.family_id, live.revoked_at.is_(None))
+    return (RefreshToken.expires_at < (now or datetime.now())) | (RefreshToken.revoked_at.is_not(None) & ~live_family)
+
+
+# deletes the stale refresh tokens one committed batch at a time, with dry_run only counts them
+def purge_refresh_tokens(db: Session, batch_size: int = RETENTION_BATCH_SIZE, dry_run: bool = False) -> int:
+    condition = stale_refresh_tokens()
+    if dry_run:
+        return db.scalar(select(func.count()).select_from(RefreshToken).where(condition))
+    purged = 0
+    while ids := db.scalars(select(RefreshToken.id).where(condition).limit(batch_size)).all():
+        db.execute(delete(RefreshToken).where(RefreshToken.id.in_(ids)))
+        db.commit()
+        purged += len(ids)
+    return purged
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and delete scraped jobs past the retention policy")
+    parser.add_argument("--max-age-days", type=int, default=SCRAPED_JOB_RETENTION_DAYS, help="0 keeps jobs of any age")
+    parser.add_argument("--per-source", type=int, default=SCRAPED_JOBS_PER_SOURCE, help="newest jobs each source keeps, 0 for no cap")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0, help="seconds to sleep between batches")
+    parser.add_argument("--archive-dir", default=ARCHIVE_DIR)
+    parser.add_argument("--compression", choices=sorted(ARCHIVE_EXTENSIONS), default=ARCHIVE_COMPRESSION)
+    parser.add_argument("--no-archive", action="store_true", help="delete without archiving")
+    parser.add_argument("--dry-run", action="store_true", help="only count the jobs that would be purged")
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        sys.exit("--batch-size must be at least 1")
+
+    from database import SessionLocal
+    archive = None if args.no_archive or args.dry_run else Archive(args.archive_dir, args.compression)
+    session = SessionLocal()
+    try:
+        purged = enforce_retention(
+            session, args.max_age_days, args.per_source, archive, args.batch_size, args.pause, args.dry_run
+        )
+        tokens = purge_refresh_tokens(session, args.batch_size, args.dry_run)
+    finally:
+        session.close()
+    for rule, count in purged.items():
+        print(f"{rule}: {count} scraped jobs {'to purge' if args.dry_run else 'purged'}")
+    print(f"{sum(purged.values())} scraped jobs {'would be purged' if args.dry_run else 'purged'}"
+          + (f", archived to {archive.directory}" if archive is not None else ""))
+    print(f"{tokens} expired or revoked refresh tokens {'to delete' if args.dry_run else 'deleted'}")
@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional
-from datetime import datetime
+from typing import Annotated, Dict, Literal, Optional, Union
+from datetime import date, datetime
 from enum import Enum
 
 # valid statuses, only these are allowed
@@ -13,6 +13,13 @@ class ApplicationStatus(str, Enum):
     REJECTED = "rejected"
     ACCEPTED = "accepted"
 
+# lifecycle of a queued scrape
+class ScrapeTaskStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
 
 # USER SCHEMAS
 
@@ -34,6 +41,11 @@ class UserResponse(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+# schema for refreshing or revoking a session
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
 
 # SCRAPED JOB SCHEMAS:
 
@@ -48,14 +60,68 @@ class ScrapedJobResponse(BaseModel):
     posted_date: Optional[datetime]
     source: str
     scraped_at: datetime
+    cluster_id: Optional[int] = None # set on reposts, the id of the first posting of the same job
 
     class Config:
         from_attributes = True
 
+# schema for a scraped job in lists, only the fields picked with ?fields= are present
+# the description is left out, GET /scraped-jobs/{id} has it
+class ScrapedJobListItem(BaseModel):
+    id: int
+    title: Optional[str] = None
+    company: Optional[str] = None
+    location: Optional[str] = None
+    url: Optional[str] = None
+    posted_date: Optional[datetime] = None
+    source: Optional[str] = None
+    scraped_at: Optional[datetime] = None
+    cluster_id: Optional[int] = None
+
 # schema for list of scraped jobs
 class ScrapedJobListResponse(BaseModel):
     count: int
-    jobs: list[ScrapedJobResponse]
+    jobs: list[ScrapedJobListItem]
+    next_cursor: Optional[str] = None # pass back as ?cursor= to get the next page
+
+# schema for a queued scrape and its progress
+class ScrapeTaskResponse(BaseModel):
+    id: int
+    status: ScrapeTaskStatus
+    query: str
+    location: str
+    max_results: int
+    sources: list[str]
+    attempts: int
+    scraped: int # jobs found by the scrapers
+    inserted: int # new jobs stored
+    duplicates: int # jobs skipped because their url was already stored
+    error: Optional[str]
+    created_at: datetime
+    next_attempt_at: Optional[datetime]
+    started_at: Optional[datetime]
+    finished_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+# most scraped jobs one convert request may name
+MAX_CONVERT_JOBS = 500
+
+# schema for converting several scraped jobs into applications at once
+class ConvertRequest(BaseModel):
+    job_ids: list[int] = Field(..., min_length=1, max_length=MAX_CONVERT_JOBS)
+
+# a scraped job and the application tracking it
+class ConvertedJob(BaseModel):
+    job_id: int
+    application_id: int
+
+# schema for convert results, every requested job id is in exactly one of the lists
+class ConvertResponse(BaseModel):
+    created: list[ConvertedJob]
+    existing: list[ConvertedJob] # already converted before, nothing was changed
+    not_found: list[int]
 
 
 
@@ -98,8 +164,84 @@ class ApplicationResponse(BaseModel):
     class Config:
         from_attributes = True
 
+# schema for an application in lists, only the fields picked with ?fields= are present
+# the notes are left out, GET /applications/{id} has them
+class ApplicationListItem(BaseModel):
+    id: int
+    user_id: Optional[int] = None
+    company: Optional[str] = None
+    position: Optional[str] = None
+    status: Optional[ApplicationStatus] = None
+    job_url: Optional[str] = None
+    applied_date: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    salary_range: Optional[str] = None
+
 # schema for list of applications
 class ApplicationListResponse(BaseModel):
     count: int
-    applications: list[ApplicationResponse]
-    
\ No newline at end of file
+    applications: list[ApplicationListItem]
+    next_cursor: Optional[str] = None # pass back as ?cursor= to get the next page
+
+
+
+# schema for one rejected row in a bulk import
+class BulkImportError(BaseModel):
+    row: int # 1 based position of the row in the upload
+    errors: list[str]
+
+# schema for bulk import results
+class BulkImportResponse(BaseModel):
+    created: int
+    failed: int
+    errors: list[BulkImportError]
+
+# BATCH SCHEMAS
+
+# most operations in one batch, and most ids one update or delete may name
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_IDS = 1000
+
+# batch operation that creates one application
+class BatchCreate(BaseModel):
+    op: Literal["create"]
+    application: ApplicationCreate
+
+# batch operation that applies the same changes to every listed application
+class BatchUpdate(BaseModel):
+    op: Literal["update"]
+    ids: list[int] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
+    changes: ApplicationUpdate
+
+# batch operation that deletes every listed application
+class BatchDelete(BaseModel):
+    op: Literal["delete"]
+    ids: list[int] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
+
+BatchOperation = Annotated[Union[BatchCreate, BatchUpdate, BatchDelete], Field(discriminator="op")]
+
+# operations run in order in one transaction, if one fails none of them is applied
+class BatchRequest(BaseModel):
+    operations: list[BatchOperation] = Field(..., min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+# what one operation did, the id created or the ids updated or deleted
+class BatchResult(BaseModel):
+    op: str
+    ids: list[int]
+
+# results in the order of the operations
+class BatchResponse(BaseModel):
+    results: list[BatchResult]
+
+# applications created in one week
+class WeeklyCount(BaseModel):
+    week_start: date # the monday of the week
+    count: int
+
+# pipeline numbers for the logged in user
+class ApplicationStats(BaseModel):
+    total: int
+    by_status: Dict[ApplicationStatus, int]
+    weekly: list[WeeklyCount] # oldest first, weeks without applications are left out
+    offer_rate: Optional[float] # offers and accepted over everything past wishlist, null until something was applied to
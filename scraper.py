@@ -1,60 +1,198 @@
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict, Optional
-from datetime import datetime
+import asyncio
+import httpx
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, List, Optional, Sequence
+from urllib.parse import urlsplit
+import math
 import time
 import logging
+from metrics import scrape_fetch_time, scrape_parse_time, timed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# max requests in flight across every source, also the size of the keep-alive pool
+DEFAULT_CONCURRENCY = 8
+# min seconds between two requests to the same host
+DEFAULT_HOST_INTERVAL = 0.5
+DEFAULT_TIMEOUT = 10
+
+
+class ScrapeError(Exception):
+    pass
+
+
+# spaces requests to each host at least `interval` seconds apart
+class HostRateLimiter:
+    def __init__(self, interval: float = DEFAULT_HOST_INTERVAL):
+        self.interval = interval
+        self._next_slot: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    # each caller reserves the next free slot under the lock and sleeps until it after releasing it,
+    # so callers for the same host queue up without holding anything while they wait
+    async def wait(self, host: str):
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = time.monotonic()
+            slot = max(self._next_slot.get(host, now), now)
+            self._next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+# shared http client for a scrape, reuses pooled keep-alive connections and bounds concurrency
+class ScrapeEngine:
+    def __init__(
+        self,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        host_interval: float = DEFAULT_HOST_INTERVAL,
+        timeout: float = DEFAULT_TIMEOUT,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            follow_redirects=True,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            transport=transport
+        )
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = HostRateLimiter(host_interval)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def fetch(self, url: str, params: Optional[dict] = None, headers: Optional[dict] = None) -> httpx.Response:
+        host = urlsplit(url).netloc
+        # waited out before taking a concurrency slot, pages queued for a throttled host don't hold slots other hosts could use
+        await self.rate_limiter.wait(host)
+        async with self.semaphore:
+            # timed after the rate limiter, so only the request itself counts
+            start = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await self.client.get(url, params=params, headers=headers)
+                outcome = str(response.status_code)
+            finally:
+                scrape_fetch_time.observe(time.perf_counter() - start, host, outcome)
+            response.raise_for_status()
+            return response
+
+    # runs one query against every source at once
+    # a failing source is logged and skipped, it only raises if every source failed
+    async def search(self, sources: Sequence["JobSource"], query: str, location: str = "", max_results: int = 20) -> List[dict]:
+        results = await asyncio.gather(
+            *(source.search(self, query, location, max_results) for source in sources),
+            return_exceptions=True
+        )
+
+        jobs = []
+        failures = []
+        for source, result in zip(sources, results):
+            if isinstance(result, Exception):
+                logger.error(f"Error scraping {source.name}: {result}")
+                failures.append(result)
+                continue
+            jobs.extend(result)
+
+        if sources and len(failures) == len(sources):
+            raise ScrapeError(f"Every source failed: {failures[0]}")
+        return jobs
+
+
+def run_search(sources: Sequence["JobSource"], query: str, location: str = "", max_results: int = 20, **engine_options) -> List[dict]:
+    # sync entry point, runs a whole scrape on its own event loop
+    async def _search():
+        async with ScrapeEngine(**engine_options) as engine:
+            return await engine.search(sources, query, location, max_results)
+    return asyncio.run(_search())
+
+
+# interface every job board implements
+class JobSource(ABC):
+    name: str
+
+    @abstractmethod
+    async def search(self, engine: ScrapeEngine, query: str, location: str = "", max_results: int = 20) -> List[dict]:
+        ...
+
+    # jobs for a single source, kept for callers that don't manage an engine
+    # the whole scrape runs before the first job comes out, it doesn't stream pages as they are fetched
+    def search_jobs(self, query: str, location: str = "", max_results: int = 20) -> Iterator[dict]:
+        try:
+            yield from run_search([self], query, location, max_results)
+        except ScrapeError as e:
+            logger.error(str(e))
+
+
 # scrapes jobs from indeed
 # indeed blocks web scrapers but still want to include
-class IndeedScraper:
-    def __init__(self):
-        self.base_url = "https://www.indeed.com"
+class IndeedScraper(JobSource):
+    name = "indeed"
+    # indeed pages its results with start= in steps of this size
+    page_size = 10
+    # most pages one search fetches at once, whatever max_results asks for
+    max_pages = 10
+
+    def __init__(self, base_url: str = "https://www.indeed.com"):
+        self.base_url = base_url
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         }
-    
-    def search_jobs(self, query: str, location: str = "", max_results: int = 20) -> List[dict]:
-        jobs = []
 
-        # build search url
+    # fetches every result page needed for max_results concurrently
+    async def search(self, engine: ScrapeEngine, query: str, location: str = "", max_results: int = 20) -> List[dict]:
         search_url = f"{self.base_url}/jobs"
-        params = {
-            'q': query,
-            'l': location,
-            'limit': 50
-        }
+        pages = min(self.max_pages, max(1, math.ceil(max_results / self.page_size)))
 
-        try:
-            logger.info(f"Searching Indeed for '{query}' in '{location}'")
-            response = requests.get(search_url, headers=self.headers, params=params, timeout=10)
-            response.raise_for_status()
+        logger.info(f"Searching Indeed for '{query}' in '{location}' ({pages} pages)")
+        responses = await asyncio.gather(
+            *(engine.fetch(search_url, params={"q": query, "l": location, "start": page * self.page_size}, headers=self.headers)
+              for page in range(pages)),
+            return_exceptions=True
+        )
 
-            soup = BeautifulSoup(response.content, "lxml")
+        jobs = []
+        seen_urls = set()
+        errors = []
+        for response in responses:
+            if isinstance(response, Exception):
+                logger.error(f"Error fetching Indeed page: {response}")
+                errors.append(response)
+                continue
+            # parsing is cpu bound, keep it off the event loop
+            for job in await asyncio.to_thread(self.parse_search_page, response.content):
+                # pages can overlap when new postings shift the results
+                if job["url"] not in seen_urls:
+                    seen_urls.add(job["url"])
+                    jobs.append(job)
+
+        if len(errors) == len(responses):
+            raise errors[0]
+        logger.info(f"Successfully parsed {len(jobs)} jobs")
+        return jobs[:max_results]
+
+    def parse_search_page(self, html: bytes) -> List[dict]:
+        # bs4 and lxml take longer to import than the rest of the scraper, only pay for them once a page is parsed
+        from bs4 import BeautifulSoup
+        with timed(scrape_parse_time, self.name):
+            soup = BeautifulSoup(html, "lxml")
 
             # find job cards
             job_cards = soup.find_all("div", class_="job_seen_beacon")
 
             if not job_cards:
                 job_cards = soup.find_all("td", class_="resultContent")
-            
+
             logger.info(f"Found {len(job_cards)} job cards")
+            return [job for job in map(self._parse_job_card, job_cards) if job]
 
-            for card in job_cards[:max_results]:
-                job = self._parse_job_card(card)
-                if job:
-                    jobs.append(job)
-                time.sleep(0.5)
-            logger.info(f"Successfully parsed {len(jobs)} jobs")
-            return jobs
-        
-        except Exception as e:
-            logger.error(f"Error scraping Indeed: {e}")
-            return []
-        
     # parse individual job cards
     def _parse_job_card(self, card) -> Optional[dict]:
         try:
@@ -97,8 +235,10 @@ class IndeedScraper:
             return None
 
 # simple scraper that just demonstrates the concept
-class MockScraper:
-    def search_jobs(self, query: str, location: str = "", max_results: int = 20) -> List[Dict]:
+class MockScraper(JobSource):
+    name = "mock"
+
+    async def search(self, engine: ScrapeEngine, query: str, location: str = "", max_results: int = 20) -> List[Dict]:
         return [
             {
                 "title": f"{query} - Position 1",
@@ -127,3 +267,14 @@ class MockScraper:
         ]
 
 
+# sources that can be picked by name
+SOURCES = {
+    IndeedScraper.name: IndeedScraper,
+    MockScraper.name: MockScraper,
+}
+
+def get_sources(names: Sequence[str]) -> List[JobSource]:
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        raise ValueError(f"Unknown scrape source: {', '.join(unknown)}")
+    return [SOURCES[name]() for name in dict.fromkeys(names)]
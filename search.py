@@ -0,0 +1,72 @@
+import re
+from typing import List, Optional, Sequence, Tuple
+from fastapi import HTTPException, status
+from sqlalchemy import column, func, literal_column, select, table, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import ScrapedJob
+from serialization import rows_to_dicts
+from pagination import decode_cursor, encode_cursor
+
+# bm25 weights for title, company and description, mirrors the A/B/C weights on postgres
+SQLITE_COLUMN_WEIGHTS = (10.0, 5.0, 1.0)
+
+# the search index lives outside the ORM models, see SCRAPED_JOBS_SEARCH_DDL_* in database.py
+scraped_jobs_fts = table("scraped_jobs_fts", column("rowid"))
+
+
+# turns free text into an FTS5 query of quoted terms so user input can't use FTS5 syntax
+def _fts5_query(q: str) -> str:
+    return " ".join(f'"{term}"' for term in re.findall(r"\w+", q))
+
+
+def _postgres_search(q: str, columns: list):
+    # the text search config is inlined, it has to match the one the generated column was built with
+    tsquery = func.websearch_to_tsquery(literal_column("'english'"), q)
+    vector = literal_column("scraped_jobs.search_vector")
+    score = func.ts_rank_cd(vector, tsquery)
+    return select(*columns).where(vector.op("@@")(tsquery)), score
+
+
+def _sqlite_search(q: str, columns: list):
+    fts = literal_column("scraped_jobs_fts")
+    # bm25 is lower for better matches, negate it so both backends sort by score descending
+    score = -func.bm25(fts, *SQLITE_COLUMN_WEIGHTS)
+    stmt = (
+        select(*columns)
+        .join(scraped_jobs_fts, scraped_jobs_fts.c.rowid == ScrapedJob.id)
+        .where(fts.op("MATCH")(_fts5_query(q)))
+    )
+    return stmt, score
+
+
+SEARCH_BACKENDS = {
+    "postgresql": _postgres_search,
+    "sqlite": _sqlite_search,
+}
+
+
+# ranked full text search, best match first, paged with a cursor on (score, id)
+# returns the jobs as plain dicts holding the given ScrapedJob fields, which must include id
+async def search_scraped_jobs(db: AsyncSession, q: str, cursor: Optional[str], limit: int, fields: Sequence[str], collapse: bool = False) -> Tuple[List[dict], Optional[str]]:
+    backend = SEARCH_BACKENDS.get(db.get_bind().dialect.name)
+    if backend is None:
+        raise HTTPException(status_code=status.HTTP_501_NOT_IMPLEMENTED, detail="Search is not supported on this database")
+
+    if not re.search(r"\w", q):
+        return [], None
+
+    stmt, score = backend(q, [getattr(ScrapedJob, name) for name in fields])
+    stmt = stmt.add_columns(score.label("score"))
+    if collapse:
+        stmt = stmt.where(ScrapedJob.cluster_id.is_(None))
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, parse=float)
+        stmt = stmt.where(tuple_(score, ScrapedJob.id) < tuple_(last_score, last_id))
+
+    rows = (await db.execute(stmt.order_by(score.desc(), ScrapedJob.id.desc()).limit(limit + 1))).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].score, rows[-1].id)
+    return rows_to_dicts(rows, fields), next_cursor
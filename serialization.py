@@ -0,0 +1,34 @@
+from typing import Iterable, List, Optional, Sequence
+from fastapi import HTTPException, status
+from pydantic import BaseModel
+
+# fast path for the list endpoints
+# they select only the columns the response needs and hand plain dicts to orjson,
+# skipping the ORM objects and the per row pydantic validation of response_model
+
+
+# the model columns named like the schema fields, in schema order
+def response_columns(schema: type[BaseModel], model) -> list:
+    return [getattr(model, name) for name in schema.model_fields]
+
+
+# keys names the leading columns of each row to keep, trailing ones only needed by the query are dropped
+def rows_to_dicts(rows: Iterable, keys: Optional[Sequence[str]] = None) -> List[dict]:
+    if keys is None:
+        return [row._asdict() for row in rows]
+    return [dict(zip(keys, row)) for row in rows]
+
+
+# turns ?fields=company,status into the fields to select, id is always included so rows can be fetched again
+# no fields= means every allowed field
+def parse_fields(fields: Optional[str], allowed: Sequence[str]) -> List[str]:
+    if not fields:
+        return list(allowed)
+    requested = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in requested if name not in allowed]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Unknown field: {', '.join(unknown)}. Pick from {', '.join(allowed)}"
+        )
+    return ["id"] + [name for name in dict.fromkeys(requested) if name != "id"]
@@ -0,0 +1,160 @@
+import sys
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import Date, cast, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from database import ApplicationStatusCount, ApplicationWeeklyCount, JobApplication
+from ingest import UPSERT_INSERTS
+from schemas import ApplicationStatus
+
+# pipeline statistics per user
+# every write to applications adds its change to the counter tables in the same transaction,
+# so GET /applications/stats reads a handful of rows instead of scanning a user's applications
+
+status_counts = ApplicationStatusCount.__table__
+weekly_counts = ApplicationWeeklyCount.__table__
+
+
+def week_start(moment: datetime) -> date:
+    return (moment - timedelta(days=moment.weekday())).date()
+
+
+# change to the counters made by one transaction
+class StatsDelta:
+    def __init__(self):
+        self.statuses = Counter()
+        self.weeks = Counter()
+
+    def add(self, status: Optional[ApplicationStatus], created_at: Optional[datetime], sign: int = 1):
+        if status is not None:
+            self.statuses[status] += sign
+        if created_at is not None:
+            self.weeks[week_start(created_at)] += sign
+
+    def remove(self, status: Optional[ApplicationStatus], created_at: Optional[datetime]):
+        self.add(status, created_at, sign=-1)
+
+    def move(self, old_status: Optional[ApplicationStatus], new_status: Optional[ApplicationStatus]):
+        self.add(old_status, None, sign=-1)
+        self.add(new_status, None)
+
+
+def _counter_upserts(dialect_name: str, user_id: int, delta: StatsDelta):
+    for table, key, changes in ((status_counts, "status", delta.statuses), (weekly_counts, "week_start", delta.weeks)):
+        # sorted so concurrent transactions lock counter rows in the same order
+        rows = [{"user_id": user_id, key: value, "count": change} for value, change in sorted(changes.items(), key=lambda item: str(item[0])) if change]
+        if not rows:
+            continue
+        dialect_insert = UPSERT_INSERTS.get(dialect_name)
+        if dialect_insert is not None:
+            stmt = dialect_insert(table).values(rows)
+            yield stmt.on_conflict_do_update(
+                index_elements=["user_id", key],
+                set_={"count": table.c.count + stmt.excluded["count"]}
+            ), None
+        else:
+            # other backends, bump the row and insert it when there was none
+            for row in rows:
+                yield (
+                    update(table)
+                    .where(table.c.user_id == user_id, table.c[key] == row[key])
+                    .values(count=table.c.count + row["count"])
+                ), insert(table).values(row)
+
+
+# applies a delta inside the caller's transaction, the caller commits
+async def apply_stats(db: AsyncSession, user_id: int, delta: StatsDelta):
+    for stmt, fallback in _counter_upserts(db.get_bind().dialect.name, user_id, delta):
+        result = await db.execute(stmt)
+        if fallback is not None and not result.rowcount:
+            await db.execute(fallback)
+
+
+# monday of the week an application was created, computed by the database
+def week_start_column(dialect_name: str):
+    if dialect_name == "postgresql":
+        return cast(func.date_trunc("week", JobApplication.created_at), Date)
+    if dialect_name == "sqlite":
+        return func.date(JobApplication.created_at, "weekday 0", "-6 days")
+    raise ValueError(f"Application stats are not supported on {dialect_name} databases")
+
+
+def _grouped(dialect_name: str, user_id: Optional[int] = None):
+    week = week_start_column(dialect_name).label("week_start")
+    by_status = (
+        select(JobApplication.user_id, JobApplication.status, func.count().label("count"))
+        .where(JobApplication.status.is_not(None))
+        .group_by(JobApplication.user_id, JobApplication.status)
+    )
+    by_week = (
+        select(JobApplication.user_id, week, func.count().label("count"))
+        .where(JobApplication.created_at.is_not(None))
+        .group_by(JobApplication.user_id, week)
+    )
+    if user_id is not None:
+        by_status = by_status.where(JobApplication.user_id == user_id)
+        by_week = by_week.where(JobApplication.user_id == user_id)
+    return by_status, by_week
+
+
+# recomputes the counters from scratch, for the backfill or after a failed check
+def rebuild(db: Session, user_id: Optional[int] = None):
+    by_status, by_week = _grouped(db.get_bind().dialect.name, user_id)
+    for table, grouped, key in ((status_counts, by_status, "status"), (weekly_counts, by_week, "week_start")):
+        clear = delete(table)
+        if user_id is not None:
+            clear = clear.where(table.c.user_id == user_id)
+        db.execute(clear)
+        db.execute(insert(table).from_select(["user_id", key, "count"], grouped))
+    db.commit()
+
+
+def _as_key(value):
+    # sqlite hands back the computed week as text
+    return value.isoformat() if isinstance(value, date) else value
+
+
+# compares the counters with a full GROUP BY over applications, returns the mismatches
+def check(db: Session, user_id: Optional[int] = None) -> list:
+    by_status, by_week = _grouped(db.get_bind().dialect.name, user_id)
+    mismatches = []
+    for table, grouped, key in ((status_counts, by_status, "status"), (weekly_counts, by_week, "week_start")):
+        stored_query = select(table.c.user_id, table.c[key], table.c.count)
+        if user_id is not None:
+            stored_query = stored_query.where(table.c.user_id == user_id)
+        expected = {(row[0], _as_key(row[1])): row[2] for row in db.execute(grouped)}
+        stored = {(row[0], _as_key(row[1])): row[2] for row in db.execute(stored_query)}
+        for user, value in sorted(expected.keys() | stored.keys(), key=str):
+            # a counter that dropped to zero is the same as no row
+            if expected.get((user, value), 0) != stored.get((user, value), 0):
+                mismatches.append({
+                    "user_id": user,
+                    key: value,
+                    "expected": expected.get((user, value), 0),
+                    "stored": stored.get((user, value), 0),
+                })
+    return mismatches
+
+
+# python stats.py rebuild|check [user_id]
+if __name__ == "__main__":
+    from database import SessionLocal
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    user = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    session = SessionLocal()
+    try:
+        if command == "rebuild":
+            rebuild(session, user)
+            print("Application stats rebuilt")
+        elif command == "check":
+            problems = check(session, user)
+            for problem in problems:
+                print(problem)
+            print(f"{len(problems)} mismatched counters")
+            sys.exit(1 if problems else 0)
+        else:
+            sys.exit(f"Unknown command {command}, use rebuild or check")
+    finally:
+        session.close()
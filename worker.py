@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select, update, or_, and_
+from sqlalchemy.orm import Session
+from database import SessionLocal, ScrapeTask
+from ingest import ingest_scraped_jobs
+from schemas import ScrapeTaskStatus
+from metrics import scrape_task_time
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# worker threads started inside the api process, 0 leaves the queue to `python worker.py`
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "2"))
+# attempts before a task is marked failed, retries back off exponentially from SCRAPE_RETRY_BACKOFF seconds
+SCRAPE_MAX_ATTEMPTS = int(os.getenv("SCRAPE_MAX_ATTEMPTS", "3"))
+SCRAPE_RETRY_BACKOFF = float(os.getenv("SCRAPE_RETRY_BACKOFF", "30"))
+# a running task older than this is assumed to belong to a dead worker and is picked up again
+SCRAPE_TASK_TIMEOUT = float(os.getenv("SCRAPE_TASK_TIMEOUT", "600"))
+# seconds an idle worker waits before polling the queue again
+POLL_INTERVAL = 1.0
+
+
+def task_dedupe_key(user_id: int, query: str, location: str, max_results: int, sources: list) -> str:
+    key = json.dumps([user_id, query.strip().lower(), location.strip().lower(), max_results, sorted(sources)])
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _claimable(now: datetime):
+    stale_before = now - timedelta(seconds=SCRAPE_TASK_TIMEOUT)
+    return or_(
+        and_(ScrapeTask.status == ScrapeTaskStatus.PENDING, ScrapeTask.next_attempt_at <= now),
+        and_(ScrapeTask.status == ScrapeTaskStatus.RUNNING, ScrapeTask.started_at < stale_before)
+    )
+
+
+# marks the oldest due task as running and returns it, or None when the queue is empty
+def claim_next_task(db: Session) -> Optional[ScrapeTask]:
+    now = datetime.now()
+    candidate = select(ScrapeTask.id).where(_claimable(now)).order_by(ScrapeTask.next_attempt_at, ScrapeTask.id).limit(1)
+    if db.get_bind().dialect.name == "postgresql":
+        candidate = candidate.with_for_update(skip_locked=True)
+
+    task_id = db.scalar(candidate)
+    if task_id is None:
+        db.commit()
+        return None
+
+    # repeating the condition makes the claim atomic when two workers race for the same row
+    claimed = db.execute(
+        update(ScrapeTask)
+        .where(ScrapeTask.id == task_id, _claimable(now))
+        .values(status=ScrapeTaskStatus.RUNNING, attempts=ScrapeTask.attempts + 1, started_at=now)
+    ).rowcount
+    db.commit()
+    if not claimed:
+        return None
+    return db.get(ScrapeTask, task_id)
+
+
+def run_task(db: Session, task: ScrapeTask) -> None:
+    logger.info(f"Running scrape task {task.id} (attempt {task.attempts})")
+    start = time.perf_counter()
+    try:
+        # the scraping stack is imported by the first task, api processes that never scrape don't load it
+        from scraper import get_sources, run_search
+        jobs = run_search(get_sources(task.sources), task.query, task.location, task.max_results)
+        task.scraped = len(jobs)
+        db.commit()
+        inserted, duplicates = ingest_scraped_jobs(db, jobs)
+    except Exception as e:
+        db.rollback()
+        task.error = str(e)
+        if task.attempts < SCRAPE_MAX_ATTEMPTS:
+            delay = SCRAPE_RETRY_BACKOFF * 2 ** (task.attempts - 1)
+            logger.warning(f"Scrape task {task.id} failed, retrying in {delay:.0f}s: {e}")
+            task.status = ScrapeTaskStatus.PENDING
+            task.next_attempt_at = datetime.now() + timedelta(seconds=delay)
+        else:
+            logger.error(f"Scrape task {task.id} failed after {task.attempts} attempts: {e}")
+            task.status = ScrapeTaskStatus.FAILED
+            task.finished_at = datetime.now()
+        db.commit()
+        scrape_task_time.observe(time.perf_counter() - start, task.status.value)
+        return
+
+    task.status = ScrapeTaskStatus.SUCCEEDED
+    task.inserted = len(inserted)
+    task.duplicates = duplicates
+    task.error = None
+    task.finished_at = datetime.now()
+    db.commit()
+    scrape_task_time.observe(time.perf_counter() - start, task.status.value)
+
+
+# claims and runs one queued scrape, returns whether there was one to run
+def work_once() -> bool:
+    db = SessionLocal()
+    try:
+        task = claim_next_task(db)
+        if task is None:
+            return False
+        run_task(db, task)
+        return True
+    finally:
+        db.close()
+
+
+# fixed size pool of threads pulling scrape tasks off the queue table
+class ScrapeWorkerPool:
+    def __init__(self, size: int = SCRAPE_WORKERS):
+        self.size = size
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for number in range(self.size):
+            thread = threading.Thread(target=self._run, name=f"scrape-worker-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                busy = work_once()
+            except Exception as e:
+                logger.error(f"Scrape worker error: {e}")
+                busy = False
+            if not busy:
+                self._stop.wait(POLL_INTERVAL)
+
+
+# run the workers as their own process, next to api processes started with SCRAPE_WORKERS=0
+if __name__ == "__main__":
+    pool = ScrapeWorkerPool(max(SCRAPE_WORKERS, 1))
+    pool.start()
+    logger.info(f"Started {pool.size} scrape workers")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pool.stop()